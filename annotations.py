@@ -0,0 +1,138 @@
+"""
+
+    Copyright (C) 2019 - 2020  Zhengyu Peng
+    E-mail: zpeng.me@gmail.com
+    Website: https://zpeng.me
+
+    `                      `
+    -:.                  -#:
+    -//:.              -###:
+    -////:.          -#####:
+    -/:.://:.      -###++##:
+    ..   `://:-  -###+. :##:
+           `:/+####+.   :##:
+    .::::::::/+###.     :##:
+    .////-----+##:    `:###:
+     `-//:.   :##:  `:###/.
+       `-//:. :##:`:###/.
+         `-//:+######/.
+           `-/+####/.
+             `+##+.
+              :##:
+              :##:
+              :##:
+              :##:
+              :##:
+               .+:
+
+"""
+
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import get_format, save_dataset
+
+
+# one append-only log of labels per test case, next to its data files
+ANNOTATION_FILE = 'annotations.sqlite'
+
+ANNOTATION_COLUMNS = ['file', '_IDS_', 'label', 'user', 'timestamp']
+
+
+def annotation_file(path):
+    return os.path.join(path, ANNOTATION_FILE)
+
+
+def open_annotations(path):
+    connection = sqlite3.connect(annotation_file(path), timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS annotations ('
+        'file TEXT NOT NULL, '
+        'ids INTEGER NOT NULL, '
+        'label TEXT NOT NULL, '
+        'user TEXT, '
+        'timestamp REAL NOT NULL)')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS annotations_file '
+        'ON annotations (file, ids)')
+    return connection
+
+
+def append_annotations(path, file, ids, labels, user=None, timestamp=None):
+    # labels is one label for all rows or one label per row, records are
+    # only ever appended so the log keeps the whole history
+    ids = np.asarray(ids, dtype=np.int64)
+    if isinstance(labels, str):
+        labels = [labels]*len(ids)
+    if timestamp is None:
+        timestamp = time.time()
+
+    connection = open_annotations(path)
+    try:
+        with connection:
+            connection.executemany(
+                'INSERT INTO annotations VALUES (?, ?, ?, ?, ?)',
+                [(file, int(row), label, user, timestamp)
+                 for row, label in zip(ids, labels)])
+    finally:
+        connection.close()
+
+
+def read_annotations(path, file=None):
+    # records in the order they were appended
+    if not os.path.exists(annotation_file(path)):
+        return pd.DataFrame(columns=ANNOTATION_COLUMNS)
+
+    connection = open_annotations(path)
+    try:
+        if file is None:
+            records = pd.read_sql_query(
+                'SELECT file, ids, label, user, timestamp '
+                'FROM annotations ORDER BY rowid', connection)
+        else:
+            records = pd.read_sql_query(
+                'SELECT file, ids, label, user, timestamp '
+                'FROM annotations WHERE file = ? ORDER BY rowid',
+                connection,
+                params=(file,))
+    finally:
+        connection.close()
+    return records.rename(columns={'ids': '_IDS_'})
+
+
+def latest_labels(path, file):
+    # the last label of every row, indexed by _IDS_
+    records = read_annotations(path, file)
+    records = records.drop_duplicates('_IDS_', keep='last')
+    return records.set_index('_IDS_')['label']
+
+
+def label_mask(path, file, rows, label):
+    # rows with label as their last label, as one boolean array over the
+    # rows of the data file
+    labels = latest_labels(path, file)
+    # an empty log has an object index
+    ids = labels.index.to_numpy().astype(np.int64)[labels.to_numpy() == label]
+
+    mask = np.zeros(rows, dtype=bool)
+    mask[ids[(ids >= 0) & (ids < rows)]] = True
+    return mask
+
+
+def export_annotations(path, out_file, file=None, latest=False):
+    # the whole log, or only the last label of every row, as CSV or as any
+    # format of the data files
+    records = read_annotations(path, file)
+    if latest:
+        records = records.drop_duplicates(['file', '_IDS_'], keep='last')
+    records = records.reset_index(drop=True)
+
+    if get_format(out_file) is None:
+        records.to_csv(out_file, index=False)
+    else:
+        save_dataset(records, out_file)
+    return records
@@ -29,16 +29,26 @@
 
 
 import datetime
+import time
+import uuid
 
 import redis
-import pyarrow as pa
 
-from filter import filter_all
+from filter import filter_all, filter_rows, filter_state, row_dtype
+from lod import downsample
+from annotations import append_annotations, label_mask, read_annotations
+from exports import get_job, submit_export
+from dataset import build_frame_index, encode_strings
+from dataset import list_data_files, load_projected
+from store import content_hash, dataset_version, evict_versions
+from store import has_version, read_version, store_size, write_version
+from store import deserialize, serialize
 
 import json
 import os
 
 import dash
+import flask
 import dash_daq as daq
 from dash.dependencies import Input, Output, State, MATCH, ALL
 import dash_core_components as dcc
@@ -47,11 +57,10 @@ from dash.exceptions import PreventUpdate
 import numpy as np
 import pandas as pd
 import os
-import plotly.graph_objs as go
 import plotly.io as pio
 
 from viz.viz import get_figure_data, get_figure_layout, get_host_data
-from viz.viz import get_2d_scatter, get_histogram, get_heatmap
+from viz.viz import get_2d_scatter, get_histogram, get_heatmap, get_density
 
 
 def scatter3d_data(det_list, params, layout, keys_dict, name):
@@ -85,6 +94,14 @@ def load_config(json_file):
         return json.load(read_file)
 
 
+def get_config_keys(ui_config):
+    config_keys = []
+    for group in ['numerical', 'categorical', 'host']:
+        for item in ui_config[group]:
+            config_keys.append(ui_config[group][item]['key'])
+    return config_keys
+
+
 ###############################################################
 app = dash.Dash(__name__,
                 meta_tags=[{
@@ -100,21 +117,443 @@ redis_instance = redis.StrictRedis.from_url(
     os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379'))
 
 REDIS_HASH_NAME = os.environ.get("DASH_APP_NAME", "SensorView")
-REDIS_KEYS = {"DATASET": "DATASET", "FRAME_IDX": "FRAME_IDX"}
+REDIS_KEYS = {"DATASET": "DATASET",
+              "FRAME_IDX": "FRAME_IDX",
+              "DATA_FILE": "DATA_FILE",
+              "COLUMNS": "COLUMNS",
+              "FRAME_KEY": "FRAME_KEY",
+              "METRICS": "STORE_METRICS",
+              "FILE_HASHES": "FILE_HASHES",
+              "FILTERED": "FILTERED_ROWS",
+              "DENSITY": "DENSITY",
+              "MISSING": "MISSING",
+              "HIDDEN": "HIDDEN",
+              "REVISION": "REVISION"}
+
+# sessions that are not used for a day are dropped from Redis
+SESSION_TTL = 24*60*60
+
+# flips the bits of the rows in ARGV[2:] in one step and returns the
+# values written, ARGV[1] is the TTL of the bitmap
+TOGGLE_BITS = redis_instance.register_script("""
+local bits = {}
+for i = 2, #ARGV do
+    local bit = 1-redis.call('GETBIT', KEYS[1], ARGV[i])
+    redis.call('SETBIT', KEYS[1], ARGV[i], bit)
+    bits[#bits+1] = bit
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return bits
+""")
+
+# filtered rows are only shared between the callbacks of an interaction
+FILTERED_TTL = 10*60
+FILTERED_WAIT = 10
+
+# bins per axis of the heatmap
+DENSITY_BINS = 100
+
+
+def session_key(name, session_id):
+    return REDIS_KEYS[name]+':'+session_id
+
+
+def set_session(session_id, **values):
+    for name, value in values.items():
+        redis_instance.set(
+            session_key(name, session_id), value, ex=SESSION_TTL)
+
+
+def evict_datasets(keep):
+    evicted = evict_versions(keep=keep)
+    if len(evicted) > 0:
+        redis_instance.hincrby(
+            REDIS_KEYS["METRICS"], 'evictions', len(evicted))
+
+
+def sort_frames(data, frame_key):
+    # rows of a frame have to be contiguous for the frame index, the
+    # unpacker already writes them sorted
+    if data[frame_key].is_monotonic_increasing:
+        return data
+    return data.sort_values(frame_key, kind='mergesort').reset_index(drop=True)
+
+
+def file_hash(data_file):
+    # the content hash is only computed again when the size or the
+    # modification time of the file changed
+    stat = os.stat(data_file)
+    signature = str(stat.st_size)+':'+str(stat.st_mtime_ns)+':'
+
+    cached = redis_instance.hget(
+        REDIS_KEYS["FILE_HASHES"], os.path.abspath(data_file))
+    if cached is not None and cached.decode().startswith(signature):
+        return cached.decode()[len(signature):]
+
+    hash_value = content_hash(data_file)
+    redis_instance.hset(
+        REDIS_KEYS["FILE_HASHES"],
+        os.path.abspath(data_file),
+        signature+hash_value)
+    return hash_value
+
+
+def load_session_dataset(session_id, data_file, columns, frame_key):
+    # identical files loaded with the same columns share one version
+    version = dataset_version(file_hash(data_file), columns, frame_key)
+
+    if has_version(version):
+        redis_instance.hincrby(REDIS_KEYS["METRICS"], 'hits')
+    else:
+        redis_instance.hincrby(REDIS_KEYS["METRICS"], 'misses')
+
+        new_data = sort_frames(load_projected(data_file, columns), frame_key)
+        new_data = encode_strings(new_data)
+        new_data['_IDS_'] = new_data.index
+        new_data['Visibility'] = pd.Categorical.from_codes(
+            np.zeros(len(new_data.index), dtype=np.int8),
+            categories=['visible', 'hidden'])
+
+        write_version(new_data, version)
+        evict_datasets([version])
+
+    new_data = read_version(version)
+    frame_index = build_frame_index(new_data[frame_key].to_numpy())
+
+    set_session(session_id,
+                DATASET=version,
+                DATA_FILE=data_file,
+                COLUMNS=json.dumps(columns),
+                MISSING=json.dumps(
+                    [key for key in columns if key not in new_data.columns]),
+                FRAME_KEY=frame_key,
+                FRAME_IDX=serialize(frame_index).to_pybytes())
+    return version
+
+
+def get_frame_index(session_id):
+    return deserialize(
+        redis_instance.get(session_key("FRAME_IDX", session_id)))
+
+
+def get_frame(data, frame_index, frame_arg):
+    # rows of one frame are a contiguous slice, no column scan needed
+    return data.iloc[
+        frame_index['Start'].iloc[frame_arg]:
+        frame_index['Stop'].iloc[frame_arg]
+    ]
+
+
+def set_dataset(session_id, data):
+    # the dataset is shared through a memory-mapped file, Redis only
+    # holds the version of every session
+    version = write_version(data)
+    set_session(session_id, DATASET=version)
+    evict_datasets([version])
+    return version
+
+
+def toggle_visibility(session_id, ids):
+    # hidden rows are a Redis bitmap indexed by _IDS_ next to the
+    # immutable dataset, an edit only flips the bits of the selection in
+    # one atomic script so concurrent edits never start from stale bits
+    ids = list(dict.fromkeys([int(row) for row in ids]))
+    hidden = TOGGLE_BITS(
+        keys=[session_key("HIDDEN", session_id)], args=[SESSION_TTL]+ids)
+
+    # revisions are unique, views of other sessions never share a name
+    set_session(session_id, REVISION=uuid.uuid4().hex)
+
+    # every edit is also appended to the annotation log of the test case
+    data_file = redis_instance.get(
+        session_key("DATA_FILE", session_id)).decode()
+    append_annotations(
+        os.path.dirname(data_file),
+        os.path.basename(data_file),
+        ids,
+        ['hidden' if bit else 'visible' for bit in hidden],
+        annotation_user())
+
+
+def annotation_user():
+    return flask.request.remote_user or flask.request.remote_addr
+
+
+def restore_visibility(session_id, data_file, rows):
+    # the last labels of the annotation log become the bitmap of the
+    # session in one write
+    redis_instance.delete(
+        session_key("HIDDEN", session_id),
+        session_key("REVISION", session_id))
+
+    hidden = label_mask(
+        os.path.dirname(data_file),
+        os.path.basename(data_file),
+        rows,
+        'hidden')
+    if np.any(hidden):
+        set_session(session_id,
+                    HIDDEN=np.packbits(hidden).tobytes(),
+                    REVISION=uuid.uuid4().hex)
+
+
+def apply_visibility(session_id, version, data):
+    revision = redis_instance.get(session_key("REVISION", session_id))
+    if revision is None:
+        return version, data
+
+    bits = redis_instance.get(session_key("HIDDEN", session_id))
+    codes = np.zeros(len(data.index), dtype=np.int8)
+    if bits is not None:
+        hidden = np.unpackbits(
+            np.frombuffer(bits, dtype=np.uint8))[:len(codes)]
+        codes[:len(hidden)] = hidden
+
+    # the view of the version with this session's edits, the other
+    # columns stay shared with the mapped frame
+    view = data.copy(deep=False)
+    view['Visibility'] = pd.Categorical.from_codes(
+        codes, categories=['visible', 'hidden'])
+    return version+'/'+revision.decode(), view
+
+
+def get_versioned_dataset(session_id, keys=None):
+    version = redis_instance.get(session_key("DATASET", session_id))
+    if version is None:
+        raise PreventUpdate
+    version = version.decode()
+
+    try:
+        data = read_version(version)
+    except FileNotFoundError:
+        # evicted while the session was idle, the data file is loaded
+        # again, edits of this session are kept in its bitmap
+        version = load_session_dataset(
+            session_id,
+            redis_instance.get(
+                session_key("DATA_FILE", session_id)).decode(),
+            json.loads(redis_instance.get(
+                session_key("COLUMNS", session_id))),
+            redis_instance.get(
+                session_key("FRAME_KEY", session_id)).decode())
+        data = read_version(version)
+
+    if keys is not None:
+        missing = [key for key in keys if key not in data.columns]
+        if len(missing) > 0:
+            # keys known to be missing from the file are not looked up again
+            absent = redis_instance.get(session_key("MISSING", session_id))
+            absent = [] if absent is None else json.loads(absent)
+            missing = [key for key in missing if key not in absent]
+        if len(missing) > 0:
+            # only the UI config columns are loaded with the data file,
+            # anything else is read from the file the first time it is used
+            # the frame key is read along to put the rows in the same
+            # stable order as the loaded dataset
+            frame_key = redis_instance.get(
+                session_key("FRAME_KEY", session_id)).decode()
+            extra = sort_frames(load_projected(
+                redis_instance.get(
+                    session_key("DATA_FILE", session_id)).decode(),
+                missing+[frame_key]), frame_key)
+            extra = extra[[key for key in missing if key in extra.columns]]
+            set_session(session_id, MISSING=json.dumps(
+                absent+[key for key in missing if key not in extra.columns]))
+            if len(extra.columns) > 0:
+                # the mapped frame may be shared with other sessions
+                data = data.copy()
+                for key in extra.columns:
+                    data[key] = extra[key].to_numpy()
+                version = set_dataset(session_id, data)
+
+    return apply_visibility(session_id, version, data)
+
+
+def get_dataset(session_id, keys=None):
+    return get_versioned_dataset(session_id, keys)[1]
+
+
+def get_filtered_rows(
+        version,
+        data,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values
+):
+    # every chart callback of a filter change needs the same rows, the
+    # first one filters and publishes the row index, the others read it
+    key = REDIS_KEYS["FILTERED"]+':'+version+':'+filter_state(
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values)
+    lock = key+':lock'
+
+    rows = redis_instance.get(key)
+    if rows is None and not redis_instance.set(
+            lock, 1, nx=True, ex=FILTERED_WAIT):
+        deadline = time.time()+FILTERED_WAIT
+        while rows is None and redis_instance.exists(lock) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+            rows = redis_instance.get(key)
+
+    if rows is None:
+        # the lock is also released when filtering fails, the waiting
+        # callbacks then filter on their own right away
+        try:
+            rows = filter_rows(
+                data,
+                num_keys,
+                numerical_key_values,
+                cat_keys,
+                categorical_key_values,
+                version)
+            redis_instance.set(key, rows.tobytes(), ex=FILTERED_TTL)
+        finally:
+            redis_instance.delete(lock)
+        return rows
+
+    return np.frombuffer(rows, dtype=row_dtype(len(data.index)))
+
+
+def get_filtered_table(
+        session_id,
+        keys,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values
+):
+    version, data = get_versioned_dataset(session_id, keys)
+    rows = get_filtered_rows(
+        version,
+        data,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values)
+
+    # only the columns of the chart are gathered
+    columns = list(dict.fromkeys(keys+['_IDS_']))
+    return data[columns].iloc[rows].reset_index(drop=True)
+
+
+def get_overlay_table(
+        version,
+        data,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values,
+        params,
+        layout
+):
+    # all frames overlaid are reduced to the point budget of the 3D view,
+    # the voxels span the axis ranges of the scene
+    rows = get_filtered_rows(
+        version,
+        data,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values)
+
+    keys = [params['x_det_key'], params['y_det_key'], params['z_det_key']]
+    kept = downsample(
+        [data[key].to_numpy()[rows] for key in keys],
+        [layout['x_range'], layout['y_range'], layout['z_range']],
+        data[layout['color_key']].to_numpy()[rows],
+        layout['c_range'])
+    return data.iloc[rows[kept]].reset_index(drop=True)
+
+
+def get_filtered_density(
+        session_id,
+        x_key,
+        y_key,
+        weight_key,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values,
+        bins=DENSITY_BINS
+):
+    keys = [x_key, y_key]
+    if weight_key is not None:
+        keys.append(weight_key)
+    version, data = get_versioned_dataset(session_id, keys)
+
+    # the grid only depends on the filtered rows and the axes, edges and
+    # values are cached as one float array
+    key = REDIS_KEYS["DENSITY"]+':'+version+':'+filter_state(
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values)+':'+json.dumps([keys, bins])
+    cached = redis_instance.get(key)
+    if cached is not None:
+        values = np.frombuffer(cached, dtype=np.float64)
+        return (values[:bins+1],
+                values[bins+1:2*bins+2],
+                values[2*bins+2:].reshape(bins, bins))
+
+    rows = get_filtered_rows(
+        version,
+        data,
+        num_keys,
+        numerical_key_values,
+        cat_keys,
+        categorical_key_values)
+    x_edges, y_edges, z = get_density(
+        data[keys].iloc[rows], x_key, y_key, weight_key, bins)
+
+    redis_instance.set(key, np.concatenate(
+        [x_edges, y_edges, z.ravel()]).astype(np.float64).tobytes(),
+        ex=FILTERED_TTL)
+    return x_edges, y_edges, z
+
+
+@ server.route('/metrics')
+def store_metrics():
+    metrics = {'hits': 0, 'misses': 0, 'evictions': 0}
+    for name, value in redis_instance.hgetall(
+            REDIS_KEYS["METRICS"]).items():
+        metrics[name.decode()] = int(value)
+    metrics['store_bytes'] = store_size()
+    return flask.jsonify(metrics)
+
+
+@ server.route('/annotations/<test_case>')
+def export_test_case_annotations(test_case):
+    if test_case not in test_cases:
+        flask.abort(404)
+
+    records = read_annotations('./data/'+test_case)
+    return flask.Response(
+        records.to_csv(index=False),
+        mimetype='text/csv',
+        headers={'Content-Disposition':
+                 'attachment; filename='+test_case+'_annotations.csv'})
+
+
+@ server.route('/exports/<job_id>')
+def download_export(job_id):
+    job = get_job(redis_instance, job_id)
+    if job is None or job['status'] != 'done':
+        flask.abort(404)
+    return flask.send_file(os.path.abspath(job['file']), as_attachment=True)
+
 
 test_cases = []
 for (dirpath, dirnames, filenames) in os.walk('./data'):
     test_cases.extend(dirnames)
     break
 
-data_files = []
-for r, d, f in os.walk('./data/'+test_cases[0]):
-    for file in f:
-        if '.pkl' in file:
-            data_files.append(file)
-    break
+data_files = list_data_files('./data/'+test_cases[0])
 
-app.layout = html.Div([
+main_layout = html.Div([
     dcc.Store(id='config'),
     dcc.Store(id='keys-dict'),
     dcc.Store(id='scatter3d-params'),
@@ -307,6 +746,7 @@ app.layout = html.Div([
                                 'Hide/Unhide',
                                 id='hide-left',
                                 n_clicks=0),
+                            html.Div(id='status-scatter2d-left'),
                         ], className='nine columns'),
                         html.Div([
                             html.Button(
@@ -378,8 +818,8 @@ app.layout = html.Div([
                         },
                     ),
                     html.Div([
-                        html.Div([
-                        ], className='nine columns'),
+                        html.Div(id='status-scatter2d-right',
+                                 className='nine columns'),
                         html.Div([
                             html.Button(
                                 'Export',
@@ -453,8 +893,8 @@ app.layout = html.Div([
                         },
                     ),
                     html.Div([
-                        html.Div([
-                        ], className='nine columns'),
+                        html.Div(id='status-histogram',
+                                 className='nine columns'),
                         html.Div([
                             html.Button(
                                 'Export', id='export-histogram', n_clicks=0),
@@ -495,6 +935,14 @@ app.layout = html.Div([
                         disabled=True
                     ),
                 ], className='one-third column'),
+                html.Div([
+                    html.Label('weight'),
+                    dcc.Dropdown(
+                        id='weight-heatmap',
+                        placeholder='Count',
+                        disabled=True
+                    ),
+                ], className='one-third column'),
             ], className='row flex-display'),
             dcc.Loading(
                 id='loading_heat',
@@ -505,8 +953,8 @@ app.layout = html.Div([
                             'displaylogo': False
                         },
                         figure={
-                            'data': [{'type': 'histogram2dcontour',
-                                      'x': []}
+                            'data': [{'type': 'contour',
+                                      'z': []}
                                      ],
                             'layout': {
                                 'uirevision': 'no_change'
@@ -514,8 +962,8 @@ app.layout = html.Div([
                         },
                     ),
                     html.Div([
-                        html.Div([
-                        ], className='nine columns'),
+                        html.Div(id='status-heatmap',
+                                 className='nine columns'),
                         html.Div([
                             html.Button(
                                 'Export', id='export-heatmap', n_clicks=0),
@@ -534,9 +982,22 @@ app.layout = html.Div([
     html.Div(id='left-hide-trigger', children=0, style={'display': 'none'}),
     html.Div(id='trigger', style={'display': 'none'}),
     html.Div(id='dummy', style={'display': 'none'}),
+    dcc.Interval(id='export-interval', interval=1000, disabled=True),
 ], style={'display': 'flex', 'flex-direction': 'column'},)
 
 
+def serve_layout():
+    # every page load gets its own session so users never overwrite
+    # each other's dataset or visibility edits
+    return html.Div([
+        dcc.Store(id='session-id', data=uuid.uuid4().hex),
+        main_layout,
+    ])
+
+
+app.layout = serve_layout
+
+
 @ app.callback(
     [
         Output('data-file', 'value'),
@@ -566,18 +1027,15 @@ app.layout = html.Div([
         Output('x-heatmap', 'value'),
         Output('y-heatmap', 'options'),
         Output('y-heatmap', 'value'),
+        Output('weight-heatmap', 'options'),
+        Output('weight-heatmap', 'value'),
     ],
     [
         Input('test-case', 'value')
     ])
 def test_case_selection(test_case):
     if test_case is not None:
-        data_files = []
-        for r, d, f in os.walk('./data/'+test_case):
-            for file in f:
-                if '.pkl' in file:
-                    data_files.append(file)
-            break
+        data_files = list_data_files('./data/'+test_case)
 
         if os.path.exists('./data/'+test_case+'/config.json'):
             ui_config = load_config('./data/'+test_case+'/config.json')
@@ -621,6 +1079,13 @@ def test_case_selection(test_case):
             }
             for idx, f_item in enumerate(keys_dict)
         ]
+        num_options = [
+            {
+                'label': ui_config['numerical'][f_item]['description'],
+                'value': f_item
+            }
+            for idx, f_item in enumerate(ui_config['numerical'])
+        ]
 
         return [
             data_files[0],
@@ -649,7 +1114,9 @@ def test_case_selection(test_case):
             options,
             ui_config['heatmap']['default_x'],
             options,
-            ui_config['heatmap']['default_y']
+            ui_config['heatmap']['default_y'],
+            num_options,
+            ui_config['heatmap'].get('default_weight', None)
         ]
     else:
         raise PreventUpdate
@@ -675,6 +1142,7 @@ def test_case_selection(test_case):
         State('keys-dict', 'data'),
         State('scatter3d-params', 'data'),
         State('config', 'data'),
+        State('session-id', 'data'),
     ])
 def data_file_selection(
         data_file_name,
@@ -682,26 +1150,18 @@ def data_file_selection(
         keys_dict,
         scatter3d_params,
         ui_config,
+        session_id,
 ):
     if data_file_name is not None and test_case is not None:
-        new_data = pd.read_pickle(
-            './data/'+test_case+'/'+data_file_name)
-
-        new_data['_IDS_'] = new_data.index
-        new_data['Visibility'] = 'visible'
-
-        context = pa.default_serialization_context()
-        redis_instance.set(
-            REDIS_KEYS["DATASET"],
-            context.serialize(new_data).to_buffer().to_pybytes()
-        )
-        frame_idx = new_data[
-            ui_config['numerical']
-            [ui_config['slider']]['key']].unique()
-        redis_instance.set(
-            REDIS_KEYS["FRAME_IDX"],
-            context.serialize(frame_idx).to_buffer().to_pybytes()
-        )
+        new_data = read_version(load_session_dataset(
+            session_id,
+            './data/'+test_case+'/'+data_file_name,
+            get_config_keys(ui_config),
+            keys_dict[ui_config['slider']]['key']))
+        restore_visibility(
+            session_id,
+            './data/'+test_case+'/'+data_file_name,
+            len(new_data.index))
 
         x_det = scatter3d_params['x_det_key']
         x_host = scatter3d_params['x_host_key']
@@ -742,16 +1202,14 @@ def data_file_selection(
             ]['description'],
         )
 
-        frame_idx = new_data[
-            keys_dict
-            [ui_config['slider']]['key']].unique()
-        output = [0, len(frame_idx)-1, 0]
+        frame_index = get_frame_index(session_id)
+        output = [0, len(frame_index.index)-1, 0]
 
         cat_values = []
         new_dropdown = []
         for idx, d_item in enumerate(ui_config['categorical']):
-            var_list = new_data[ui_config['categorical']
-                                [d_item]['key']].unique()
+            var_list = np.asarray(new_data[ui_config['categorical']
+                                           [d_item]['key']].unique())
 
             if ui_config['categorical'][d_item]['key'] == 'Visibility':
                 var_list = np.append(var_list, 'hidden')
@@ -842,6 +1300,7 @@ def data_file_selection(
         State('filter-trigger', 'children'),
         State('config', 'data'),
         State('scatter3d-params', 'data'),
+        State('session-id', 'data'),
     ])
 def update_filter(
     slider_arg,
@@ -857,7 +1316,8 @@ def update_filter(
     cat_keys,
     trigger_idx,
     ui_config,
-    scatter3d_params
+    scatter3d_params,
+    session_id
 ):
     ctx = dash.callback_context
     trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
@@ -865,7 +1325,6 @@ def update_filter(
     color_key = keys_dict[color_picker]['key']
     color_label = keys_dict[color_picker]['description']
 
-    slider_key = keys_dict[ui_config['slider']]['key']
     slider_label = keys_dict[ui_config['slider']
                              ]['description']
 
@@ -875,9 +1334,8 @@ def update_filter(
     y_host = scatter3d_params['y_host_key']
     z_det = scatter3d_params['z_det_key']
 
-    context = pa.default_serialization_context()
-    data = context.deserialize(redis_instance.get("DATASET"))
-    frame_idx = context.deserialize(redis_instance.get("FRAME_IDX"))
+    version, data = get_versioned_dataset(session_id)
+    frame_index = get_frame_index(session_id)
 
     x_range = [
         np.min([numerical_key_values[num_keys.index(x_det)][0],
@@ -905,9 +1363,7 @@ def update_filter(
     )
 
     if trigger_id == 'slider-frame' and not overlay_sw:
-        filterd_frame = data[
-            data[slider_key] == frame_idx[slider_arg]
-        ]
+        filterd_frame = get_frame(data, frame_index, slider_arg)
         filterd_frame = filterd_frame.reset_index()
 
         filterd_frame = filter_all(
@@ -929,28 +1385,19 @@ def update_filter(
 
     elif trigger_id == 'scatter3d' and visible_sw and \
             click_data['points'][0]['curveNumber'] == 0:
-        if data['Visibility'][
-            click_data['points'][0]['id']
-        ] == 'visible':
-            data.at[click_data['points']
-                    [0]['id'], 'Visibility'] = 'hidden'
-        else:
-            data.at[click_data['points']
-                    [0]['id'], 'Visibility'] = 'visible'
-
-        context = pa.default_serialization_context()
-        redis_instance.set(
-            REDIS_KEYS["DATASET"],
-            context.serialize(data).to_buffer().to_pybytes()
-        )
+        toggle_visibility(session_id, [click_data['points'][0]['id']])
+        version, data = get_versioned_dataset(session_id)
 
         if overlay_sw:
-            filterd_frame = filter_all(
+            filterd_frame = get_overlay_table(
+                version,
                 data,
                 num_keys,
                 numerical_key_values,
                 cat_keys,
-                categorical_key_values
+                categorical_key_values,
+                scatter3d_params,
+                scatter3d_layout
             )
 
             fig = scatter3d_data(
@@ -963,9 +1410,7 @@ def update_filter(
             filter_trig = trigger_idx+1
 
         else:
-            filterd_frame = data[
-                data[slider_key] == frame_idx[slider_arg]
-            ]
+            filterd_frame = get_frame(data, frame_index, slider_arg)
             filterd_frame = filterd_frame.reset_index()
 
             filterd_frame = filter_all(
@@ -988,12 +1433,15 @@ def update_filter(
     elif trigger_id == 'left-hide-trigger':
 
         if overlay_sw:
-            filterd_frame = filter_all(
+            filterd_frame = get_overlay_table(
+                version,
                 data,
                 num_keys,
                 numerical_key_values,
                 cat_keys,
-                categorical_key_values
+                categorical_key_values,
+                scatter3d_params,
+                scatter3d_layout
             )
 
             fig = scatter3d_data(
@@ -1006,13 +1454,7 @@ def update_filter(
             filter_trig = dash.no_update
 
         else:
-            filterd_frame = data[
-                data[
-                    ui_config['numerical']
-                    [
-                        ui_config['slider']
-                    ]['key']] == frame_idx[slider_arg]
-            ]
+            filterd_frame = get_frame(data, frame_index, slider_arg)
             filterd_frame = filterd_frame.reset_index()
 
             filterd_frame = filter_all(
@@ -1036,21 +1478,18 @@ def update_filter(
         if None not in categorical_key_values:
 
             if overlay_sw:
-                filterd_frame = filter_all(
+                filterd_frame = get_overlay_table(
+                    version,
                     data,
                     num_keys,
                     numerical_key_values,
                     cat_keys,
-                    categorical_key_values
+                    categorical_key_values,
+                    scatter3d_params,
+                    scatter3d_layout
                 )
             else:
-                filterd_frame = data[
-                    data[
-                        ui_config['numerical']
-                        [
-                            ui_config['slider']
-                        ]['key']] == frame_idx[slider_arg]
-                ]
+                filterd_frame = get_frame(data, frame_index, slider_arg)
                 filterd_frame = filterd_frame.reset_index()
 
                 filterd_frame = filter_all(
@@ -1099,6 +1538,7 @@ def update_filter(
         State('cat-key-list', 'data'),
         State('cat-key-values', 'data'),
         State('num-key-values', 'data'),
+        State('session-id', 'data'),
     ]
 )
 def update_left_graph(
@@ -1112,7 +1552,8 @@ def update_left_graph(
     num_keys,
     cat_keys,
     categorical_key_values,
-    numerical_key_values
+    numerical_key_values,
+    session_id
 ):
     x_key = keys_dict[x_left]['key']
     y_key = keys_dict[y_left]['key']
@@ -1125,11 +1566,9 @@ def update_left_graph(
     trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
 
     if left_sw:
-        context = pa.default_serialization_context()
-        data = context.deserialize(redis_instance.get("DATASET"))
-
-        filtered_table = filter_all(
-            data,
+        filtered_table = get_filtered_table(
+            session_id,
+            [x_key, y_key, color_key],
             num_keys,
             numerical_key_values,
             cat_keys,
@@ -1189,6 +1628,7 @@ def update_left_graph(
         State('cat-key-list', 'data'),
         State('cat-key-values', 'data'),
         State('num-key-values', 'data'),
+        State('session-id', 'data'),
     ]
 )
 def update_right_graph(
@@ -1202,7 +1642,8 @@ def update_right_graph(
     num_keys,
     cat_keys,
     categorical_key_values,
-    numerical_key_values
+    numerical_key_values,
+    session_id
 ):
     x_key = keys_dict[x_right]['key']
     y_key = keys_dict[y_right]['key']
@@ -1212,10 +1653,9 @@ def update_right_graph(
     color_label = keys_dict[color_right]['description']
 
     if right_sw:
-        context = pa.default_serialization_context()
-        data = context.deserialize(redis_instance.get("DATASET"))
-        filtered_table = filter_all(
-            data,
+        filtered_table = get_filtered_table(
+            session_id,
+            [x_key, y_key, color_key],
             num_keys,
             numerical_key_values,
             cat_keys,
@@ -1274,6 +1714,7 @@ def update_right_graph(
         State('cat-key-list', 'data'),
         State('cat-key-values', 'data'),
         State('num-key-values', 'data'),
+        State('session-id', 'data'),
     ]
 )
 def update_histogram(
@@ -1286,17 +1727,17 @@ def update_histogram(
     num_keys,
     cat_keys,
     categorical_key_values,
-    numerical_key_values
+    numerical_key_values,
+    session_id
 ):
     x_key = keys_dict[x_histogram]['key']
     x_label = keys_dict[x_histogram]['description']
     y_key = y_histogram
 
     if histogram_sw:
-        context = pa.default_serialization_context()
-        data = context.deserialize(redis_instance.get("DATASET"))
-        filtered_table = filter_all(
-            data,
+        filtered_table = get_filtered_table(
+            session_id,
+            [x_key],
             num_keys,
             numerical_key_values,
             cat_keys,
@@ -1333,6 +1774,7 @@ def update_histogram(
         Output('heatmap', 'figure'),
         Output('x-heatmap', 'disabled'),
         Output('y-heatmap', 'disabled'),
+        Output('weight-heatmap', 'disabled'),
     ],
     [
         Input('filter-trigger', 'children'),
@@ -1340,6 +1782,7 @@ def update_histogram(
         Input('heat-switch', 'on'),
         Input('x-heatmap', 'value'),
         Input('y-heatmap', 'value'),
+        Input('weight-heatmap', 'value'),
     ],
     [
         State('keys-dict', 'data'),
@@ -1347,6 +1790,7 @@ def update_histogram(
         State('cat-key-list', 'data'),
         State('cat-key-values', 'data'),
         State('num-key-values', 'data'),
+        State('session-id', 'data'),
     ]
 )
 def update_heatmap(
@@ -1355,23 +1799,31 @@ def update_heatmap(
     heat_sw,
     x_heat,
     y_heat,
+    weight_heat,
     keys_dict,
     num_keys,
     cat_keys,
     categorical_key_values,
-    numerical_key_values
+    numerical_key_values,
+    session_id
 ):
     if heat_sw:
         x_key = keys_dict[x_heat]['key']
         x_label = keys_dict[x_heat]['description']
         y_key = keys_dict[y_heat]['key']
         y_label = keys_dict[y_heat]['description']
-        # if processing.is_filtering_ready():
-        context = pa.default_serialization_context()
-        data = context.deserialize(redis_instance.get("DATASET"))
+        if weight_heat is None:
+            weight_key = None
+            weight_label = None
+        else:
+            weight_key = keys_dict[weight_heat]['key']
+            weight_label = keys_dict[weight_heat]['description']
 
-        filtered_table = filter_all(
-            data,
+        density = get_filtered_density(
+            session_id,
+            x_key,
+            y_key,
+            weight_key,
             num_keys,
             numerical_key_values,
             cat_keys,
@@ -1379,31 +1831,66 @@ def update_heatmap(
         )
 
         heat_fig = get_heatmap(
-            filtered_table,
+            None,
             x_key,
             y_key,
             x_label,
             y_label,
+            weight_key=weight_key,
+            weight_label=weight_label,
+            density=density
         )
         heat_x_disabled = False
         heat_y_disabled = False
+        heat_weight_disabled = False
     else:
         heat_fig = {
-            'data': [{'type': 'histogram2dcontour',
-                      'x': []}
+            'data': [{'type': 'contour',
+                      'z': []}
                      ],
             'layout': {
             }}
         heat_x_disabled = True
         heat_y_disabled = True
+        heat_weight_disabled = True
 
     return [
         heat_fig,
         heat_x_disabled,
         heat_y_disabled,
+        heat_weight_disabled,
     ]
 
 
+def queue_export(fig, test_case, suffix):
+    # rendering runs in the export worker pool, the request thread only
+    # queues the job and the status callback reports it
+    now = datetime.datetime.now()
+    timestamp = now.strftime('%Y%m%d_%H%M%S')
+    return submit_export(
+        redis_instance,
+        fig,
+        'data/'+test_case+'/images/'+timestamp+suffix,
+        scale=2)
+
+
+def export_status(job_id):
+    if not isinstance(job_id, str):
+        return None, False
+
+    job = get_job(redis_instance, job_id)
+    if job is None:
+        return None, False
+    elif job['status'] == 'done':
+        return html.A(
+            'Download '+os.path.basename(job['file']),
+            href='/exports/'+job_id), False
+    elif job['status'] == 'failed':
+        return 'Export failed: '+job['error'], False
+    else:
+        return 'Exporting...', True
+
+
 @ app.callback(
     Output('hidden-scatter2d-left', 'children'),
     Input('export-scatter2d-left', 'n_clicks'),
@@ -1414,15 +1901,7 @@ def update_heatmap(
 )
 def export_left_scatter_2d(btn, fig, test_case):
     if btn > 0:
-        now = datetime.datetime.now()
-        timestamp = now.strftime('%Y%m%d_%H%M%S')
-
-        if not os.path.exists('data/'+test_case+'/images'):
-            os.makedirs('data/'+test_case+'/images')
-
-        temp_fig = go.Figure(fig)
-        temp_fig.write_image('data/'+test_case+'/images/' +
-                             timestamp+'_fig_left.png', scale=2)
+        return queue_export(fig, test_case, '_fig_left.png')
     return 0
 
 
@@ -1436,15 +1915,7 @@ def export_left_scatter_2d(btn, fig, test_case):
 )
 def export_right_scatter_2d(btn, fig, test_case):
     if btn > 0:
-        now = datetime.datetime.now()
-        timestamp = now.strftime('%Y%m%d_%H%M%S')
-
-        if not os.path.exists('data/'+test_case+'/images'):
-            os.makedirs('data/'+test_case+'/images')
-
-        temp_fig = go.Figure(fig)
-        temp_fig.write_image('data/'+test_case+'/images/' +
-                             timestamp+'_fig_right.png', scale=2)
+        return queue_export(fig, test_case, '_fig_right.png')
     return 0
 
 
@@ -1458,15 +1929,7 @@ def export_right_scatter_2d(btn, fig, test_case):
 )
 def export_histogram(btn, fig, test_case):
     if btn > 0:
-        now = datetime.datetime.now()
-        timestamp = now.strftime('%Y%m%d_%H%M%S')
-
-        if not os.path.exists('data/'+test_case+'/images'):
-            os.makedirs('data/'+test_case+'/images')
-
-        temp_fig = go.Figure(fig)
-        temp_fig.write_image('data/'+test_case+'/images/' +
-                             timestamp+'_histogram.png', scale=2)
+        return queue_export(fig, test_case, '_histogram.png')
     return 0
 
 
@@ -1480,16 +1943,37 @@ def export_histogram(btn, fig, test_case):
 )
 def export_heatmap(btn, fig, test_case):
     if btn > 0:
-        now = datetime.datetime.now()
-        timestamp = now.strftime('%Y%m%d_%H%M%S')
+        return queue_export(fig, test_case, '_heatmap.png')
+    return 0
 
-        if not os.path.exists('data/'+test_case+'/images'):
-            os.makedirs('data/'+test_case+'/images')
 
-        temp_fig = go.Figure(fig)
-        temp_fig.write_image('data/'+test_case+'/images/' +
-                             timestamp+'_heatmap.png', scale=2)
-    return 0
+@ app.callback(
+    [
+        Output('status-scatter2d-left', 'children'),
+        Output('status-scatter2d-right', 'children'),
+        Output('status-histogram', 'children'),
+        Output('status-heatmap', 'children'),
+        Output('export-interval', 'disabled'),
+    ],
+    [
+        Input('export-interval', 'n_intervals'),
+        Input('hidden-scatter2d-left', 'children'),
+        Input('hidden-scatter2d-right', 'children'),
+        Input('hidden-histogram', 'children'),
+        Input('hidden-heatmap', 'children'),
+    ]
+)
+def update_export_status(n_intervals, *job_ids):
+    output = []
+    pending = False
+    for job_id in job_ids:
+        status, running = export_status(job_id)
+        output.append(status)
+        pending = pending or running
+
+    # polling stops once every export finished
+    output.append(not pending)
+    return output
 
 
 @app.callback(
@@ -1506,31 +1990,18 @@ def select_left_figure(selectedData):
     [
         State('selected-data-left', 'data'),
         State('left-hide-trigger', 'children'),
+        State('session-id', 'data'),
     ]
 )
 def left_hide_button(
     btn,
     selectedData,
     trigger_idx,
+    session_id,
 ):
     if btn > 0 and selectedData is not None:
-        context = pa.default_serialization_context()
-        data = context.deserialize(redis_instance.get("DATASET"))
-
         s_data = pd.DataFrame(selectedData['points'])
-        idx = s_data['id']
-        idx.index = idx
-
-        vis_idx = idx[data['Visibility'][idx] == 'visible']
-        hid_idx = idx[data['Visibility'][idx] == 'hidden']
-
-        data.loc[vis_idx, 'Visibility'] = 'hidden'
-        data.loc[hid_idx, 'Visibility'] = 'visible'
-
-        redis_instance.set(
-            REDIS_KEYS["DATASET"],
-            context.serialize(data).to_buffer().to_pybytes()
-        )
+        toggle_visibility(session_id, s_data['id'])
 
         return trigger_idx+1
 
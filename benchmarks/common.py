@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from unpack import C_FIRING_ORDER, C_LOOK_NAMES  # noqa: E402
+
+
+def make_detections(rows, frames=10000, seed=0):
+    # synthetic detection table with the columns and value ranges
+    # written by unpack_detections
+    rng = np.random.default_rng(seed)
+
+    look_type = rng.integers(1, 5, rows)
+    det_list = pd.DataFrame({
+        'Frame': np.sort(rng.integers(0, frames, rows)).astype(float),
+        'SubFrame': np.array(C_FIRING_ORDER, dtype=float)[look_type-1],
+        'LookType': look_type.astype(float),
+        'LookName': np.array(C_LOOK_NAMES, dtype=object)[look_type-1],
+        'Range': rng.uniform(0, 200, rows),
+        'Speed': rng.uniform(-40, 40, rows),
+        'UnfoldedSpeed': rng.uniform(-80, 80, rows),
+        'DoppShift': rng.integers(-2, 3, rows).astype(float),
+        'DoppUnfoldFlag': rng.integers(0, 2, rows).astype(float),
+        'Azimuth': rng.uniform(-60, 60, rows),
+        'Elevation': rng.uniform(-15, 15, rows),
+        'AzConf': rng.integers(0, 3, rows).astype(float),
+        'ElConf': rng.integers(0, 3, rows).astype(float),
+        'AFType': np.array(['RDOP', 'MONO', 'DUAL'],
+                           dtype=object)[rng.integers(0, 3, rows)],
+        'Amplitude': rng.uniform(0, 80, rows),
+        'SNR': rng.uniform(0, 40, rows),
+        'RCS': rng.uniform(-40, 20, rows),
+        'VehYawRate': rng.uniform(-5, 5, rows),
+        'VehSpeed': rng.uniform(0, 35, rows),
+        'Latitude': rng.uniform(-100, 100, rows),
+        'Longitude': rng.uniform(0, 5000, rows),
+        'Height': rng.uniform(-5, 10, rows),
+        'VehYaw': rng.uniform(-180, 180, rows),
+        'VehLat': rng.uniform(-100, 100, rows),
+        'VehLong': rng.uniform(0, 5000, rows),
+    })
+    det_list['_IDS_'] = det_list.index
+    det_list['Visibility'] = 'visible'
+    return det_list
+
+
+def timeit(func, repeat=5):
+    # best of repeat runs, in seconds
+    best = None
+    result = None
+    for idx in range(0, repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
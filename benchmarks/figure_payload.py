@@ -0,0 +1,78 @@
+"""
+Response size and encoding time of the scatter figures, with numerical
+arrays sent as JSON lists or as base64 typed arrays
+
+    python benchmarks/figure_payload.py --points 100000 1000000
+
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from plotly.io.json import to_json_plotly
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from common import make_detections, timeit  # noqa: E402
+import viz.viz as viz  # noqa: E402
+
+
+def load_hover_dict():
+    with open(os.path.join(
+            os.path.dirname(__file__), '..', 'config.json'), 'r') as file:
+        ui_config = json.load(file)
+    return {**ui_config['categorical'], **ui_config['numerical']}
+
+
+def scatter3d(det_list, hover_dict):
+    return dict(data=[viz.get_figure_data(
+        det_list,
+        'Latitude',
+        'Longitude',
+        'Height',
+        'Speed',
+        hover_dict=hover_dict)])
+
+
+def scatter2d(det_list, hover_dict):
+    return viz.get_2d_scatter(det_list, 'Range', 'Speed', 'SNR')
+
+
+def bench(build, det_list, hover_dict, binary):
+    viz.BINARY_ARRAYS = binary
+
+    def response():
+        # figure building plus the JSON encoding done by Dash
+        return to_json_plotly(build(det_list, hover_dict))
+
+    elapsed, payload = timeit(response, repeat=3)
+    return elapsed, len(payload)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[100000, 1000000])
+    args = parser.parse_args()
+
+    hover_dict = load_hover_dict()
+    print('{:<10}{:>10}{:>8}{:>12}{:>10}'.format(
+        'figure', 'points', 'arrays', 'size (MB)', 'time (s)'))
+    for points in args.points:
+        det_list = make_detections(points)
+        for key in hover_dict:
+            if hover_dict[key]['key'] not in det_list.columns:
+                det_list[hover_dict[key]['key']] = 0.0
+
+        for name, build in [('scatter3d', scatter3d),
+                            ('scatter2d', scatter2d)]:
+            for binary in [False, True]:
+                elapsed, size = bench(build, det_list, hover_dict, binary)
+                print('{:<10}{:>10,}{:>8}{:>12,.1f}{:>10.3f}'.format(
+                    name,
+                    points,
+                    'base64' if binary else 'json',
+                    size/1e6,
+                    elapsed))
@@ -0,0 +1,64 @@
+"""
+Serialize/deserialize throughput of the dataset on a detection table
+
+    python benchmarks/serialization.py --rows 2000000
+
+"""
+
+import argparse
+import os
+import pickle
+import sys
+
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from common import make_detections, timeit  # noqa: E402
+from store import deserialize, serialize  # noqa: E402
+
+
+def bench_pickle(det_list):
+    def dump():
+        return pickle.dumps(det_list, protocol=pickle.HIGHEST_PROTOCOL)
+
+    dump_time, payload = timeit(dump)
+    load_time, _ = timeit(lambda: pickle.loads(payload))
+    return dump_time, load_time, len(payload)
+
+
+def bench_ipc(det_list, compression):
+    dump_time, payload = timeit(lambda: serialize(det_list, compression))
+    load_time, _ = timeit(lambda: deserialize(payload))
+    return dump_time, load_time, payload.size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    args = parser.parse_args()
+
+    det_list = make_detections(args.rows)
+    mem_size = det_list.memory_usage(deep=True).sum()
+    print('{:,} rows, {:,.1f} MB in memory'.format(
+        args.rows, mem_size/1e6))
+    print('{:<12}{:>12}{:>8}{:>18}{:>18}'.format(
+        'format', 'size (MB)', 'ratio', 'serialize MB/s',
+        'deserialize MB/s'))
+
+    cases = [('pickle', lambda: bench_pickle(det_list)),
+             ('ipc', lambda: bench_ipc(det_list, None))]
+    for codec in ['lz4', 'zstd']:
+        if pa.Codec.is_available(codec):
+            cases.append(
+                ('ipc+'+codec,
+                 lambda codec=codec: bench_ipc(det_list, codec)))
+
+    for name, bench in cases:
+        dump_time, load_time, size = bench()
+        print('{:<12}{:>12,.1f}{:>8.2f}{:>18,.0f}{:>18,.0f}'.format(
+            name,
+            size/1e6,
+            mem_size/size,
+            mem_size/1e6/dump_time,
+            mem_size/1e6/load_time))
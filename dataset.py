@@ -0,0 +1,203 @@
+"""
+
+    Copyright (C) 2019 - 2020  Zhengyu Peng
+    E-mail: zpeng.me@gmail.com
+    Website: https://zpeng.me
+
+    `                      `
+    -:.                  -#:
+    -//:.              -###:
+    -////:.          -#####:
+    -/:.://:.      -###++##:
+    ..   `://:-  -###+. :##:
+           `:/+####+.   :##:
+    .::::::::/+###.     :##:
+    .////-----+##:    `:###:
+     `-//:.   :##:  `:###/.
+       `-//:. :##:`:###/.
+         `-//:+######/.
+           `-/+####/.
+             `+##+.
+              :##:
+              :##:
+              :##:
+              :##:
+              :##:
+               .+:
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+
+# pickle is only kept as a legacy reader/writer
+DATA_FORMATS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'arrow': '.arrow',
+    'pkl': '.pkl',
+}
+
+# low cardinality string columns stored dictionary encoded
+DICTIONARY_COLUMNS = ['LookName', 'AFType']
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def get_format(file_name):
+    ext = os.path.splitext(file_name)[1].lower()
+    for file_format, format_ext in DATA_FORMATS.items():
+        if ext == format_ext:
+            return file_format
+    return None
+
+
+def is_data_file(file_name):
+    return get_format(file_name) is not None and \
+        not os.path.basename(file_name).startswith('~')
+
+
+def list_data_files(path):
+    data_files = []
+    for r, d, f in os.walk(path):
+        for file in sorted(f):
+            if is_data_file(file):
+                data_files.append(file)
+        break
+    return data_files
+
+
+def encode_dictionary(det_list, categories=None):
+    # categories collects the values seen so far, so consecutive batches
+    # of one Arrow IPC file only ever extend the dictionary
+    det_list = det_list.copy(deep=False)
+    for key in DICTIONARY_COLUMNS:
+        if key not in det_list.columns:
+            continue
+
+        if categories is None:
+            det_list[key] = det_list[key].astype('category')
+        else:
+            known = categories.setdefault(key, [])
+            for value in pd.unique(det_list[key]):
+                if value not in known:
+                    known.append(value)
+            det_list[key] = pd.Categorical(det_list[key], categories=known)
+    return det_list
+
+
+def encode_strings(det_list):
+    # string columns of scalars are kept as categories, so pickers work
+    # on integer codes instead of Python strings
+    for key in det_list.columns:
+        column = det_list[key]
+        if not (pd.api.types.is_object_dtype(column.dtype) or
+                pd.api.types.is_string_dtype(column.dtype)):
+            continue
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            continue
+        if len(column.index) > 0 and \
+                not isinstance(column.iloc[0], str):
+            continue
+        det_list[key] = column.astype('category')
+    return det_list
+
+
+def to_table(det_list, categories=None):
+    table = pa.Table.from_pandas(
+        encode_dictionary(det_list, categories), preserve_index=False)
+    for key in DICTIONARY_COLUMNS:
+        if key in table.column_names:
+            idx = table.schema.get_field_index(key)
+            table = table.set_column(
+                idx,
+                pa.field(key, DICTIONARY_TYPE),
+                table.column(key).cast(DICTIONARY_TYPE))
+    return table
+
+
+def open_writer(file_name, schema):
+    if get_format(file_name) == 'parquet':
+        return pq.ParquetWriter(file_name, schema)
+    elif get_format(file_name) in ['feather', 'arrow']:
+        return pa.ipc.new_file(
+            file_name,
+            schema,
+            options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+    else:
+        raise ValueError(
+            'Streaming is not supported for '+os.path.basename(file_name))
+
+
+def save_dataset(det_list, file_name):
+    file_format = get_format(file_name)
+    if file_format == 'pkl':
+        det_list.to_pickle(file_name)
+    elif file_format == 'parquet':
+        pq.write_table(to_table(det_list), file_name)
+    elif file_format in ['feather', 'arrow']:
+        feather.write_feather(to_table(det_list), file_name)
+    else:
+        raise ValueError('Unknown data format '+os.path.basename(file_name))
+
+
+def load_dataset(file_name, columns=None):
+    file_format = get_format(file_name)
+    if file_format == 'pkl':
+        det_list = pd.read_pickle(file_name)
+        if columns is not None:
+            det_list = det_list[columns]
+        return det_list
+    elif file_format == 'parquet':
+        return pq.read_table(file_name, columns=columns).to_pandas()
+    elif file_format in ['feather', 'arrow']:
+        return feather.read_table(
+            file_name, columns=columns, memory_map=True).to_pandas()
+    else:
+        raise ValueError('Unknown data format '+os.path.basename(file_name))
+
+
+def get_columns(file_name):
+    # column names stored in a data file, read from the footer/schema
+    # only so the data itself is not touched
+    file_format = get_format(file_name)
+    if file_format == 'parquet':
+        return pq.read_schema(file_name).names
+    elif file_format in ['feather', 'arrow']:
+        with pa.memory_map(file_name, 'r') as source:
+            return pa.ipc.open_file(source).schema.names
+    else:
+        return list(pd.read_pickle(file_name).columns)
+
+
+def load_projected(file_name, keys):
+    # loads only the requested columns, keys missing from the file are
+    # ignored since the UI config may list keys of other sensors
+    if get_format(file_name) == 'pkl':
+        det_list = pd.read_pickle(file_name)
+        return det_list[[key for key in det_list.columns if key in keys]]
+
+    columns = get_columns(file_name)
+    return load_dataset(
+        file_name, columns=[key for key in columns if key in keys])
+
+
+def build_frame_index(values):
+    # start/stop row of every frame, values have to be sorted by frame
+    changes = np.ones(len(values), dtype=bool)
+    changes[1:] = values[1:] != values[:-1]
+    starts = np.flatnonzero(changes)
+
+    stops = np.empty_like(starts)
+    stops[:-1] = starts[1:]
+    stops[-1:] = len(values)
+    return pd.DataFrame({
+        'FrameIdx': values[starts],
+        'Start': starts,
+        'Stop': stops,
+    })
@@ -0,0 +1,120 @@
+"""
+
+    Copyright (C) 2019 - 2020  Zhengyu Peng
+    E-mail: zpeng.me@gmail.com
+    Website: https://zpeng.me
+
+    `                      `
+    -:.                  -#:
+    -//:.              -###:
+    -////:.          -#####:
+    -/:.://:.      -###++##:
+    ..   `://:-  -###+. :##:
+           `:/+####+.   :##:
+    .::::::::/+###.     :##:
+    .////-----+##:    `:###:
+     `-//:.   :##:  `:###/.
+       `-//:. :##:`:###/.
+         `-//:+######/.
+           `-/+####/.
+             `+##+.
+              :##:
+              :##:
+              :##:
+              :##:
+              :##:
+               .+:
+
+"""
+
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import plotly.graph_objs as go
+
+
+# image exports run in worker processes, request threads only queue them
+EXPORT_WORKERS = int(os.environ.get('SENSORVIEW_EXPORT_WORKERS', 2))
+
+# jobs are kept in Redis so any process of the app can report them
+EXPORT_TTL = 24*60*60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawned, the request threads of the app make forking unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def reset_executor():
+    # a crashed worker breaks the pool, the next export starts a new one
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def job_key(job_id):
+    return 'EXPORT_JOB:'+job_id
+
+
+def write_figure_image(fig, file_name, scale=2):
+    # runs in a worker process, kaleido starts once per worker
+    partial = os.path.join(
+        os.path.dirname(file_name), '~'+os.path.basename(file_name))
+    try:
+        go.Figure(fig).write_image(partial, scale=scale)
+        os.replace(partial, file_name)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return file_name
+
+
+def set_job(redis_instance, job_id, **values):
+    redis_instance.hset(job_key(job_id), mapping=values)
+    redis_instance.expire(job_key(job_id), EXPORT_TTL)
+
+
+def submit_export(redis_instance, fig, file_name, scale=2):
+    out_dir = os.path.dirname(file_name)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+
+    # the job id keeps exports of the same figure in the same second apart
+    job_id = uuid.uuid4().hex
+    root, ext = os.path.splitext(file_name)
+    file_name = root+'_'+job_id+ext
+    set_job(redis_instance, job_id,
+            status='queued', file=file_name, error='')
+
+    def finish(future):
+        try:
+            future.result()
+            set_job(redis_instance, job_id, status='done')
+        except Exception as err:
+            if isinstance(err, BrokenProcessPool):
+                reset_executor()
+            set_job(redis_instance, job_id, status='failed', error=repr(err))
+
+    future = get_executor().submit(write_figure_image, fig, file_name, scale)
+    future.add_done_callback(finish)
+    return job_id
+
+
+def get_job(redis_instance, job_id):
+    job = redis_instance.hgetall(job_key(job_id))
+    if len(job) == 0:
+        return None
+    return {name.decode(): value.decode() for name, value in job.items()}
@@ -27,40 +27,300 @@
 
 """
 
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
+from store import EDITED_COLUMNS, base_version, read_index
 
-def filter_range(data_frame, name, value):
-    temp_frame = data_frame[data_frame[name] >= value[0]]
-    return temp_frame[
-        temp_frame[name] <= value[1]
-    ].reset_index(drop=True)
 
+# bytes of predicate masks kept by each process
+MASK_CACHE_BYTES = 128*1024**2
 
-def filter_picker(data_frame, name, value):
-    return data_frame[pd.DataFrame(
-        data_frame[name].tolist()
-    ).isin(value).any(1)].reset_index(drop=True)
+# numerical columns with at least this many rows get a sorted index the
+# first time a range filter is applied to them
+INDEX_MIN_ROWS = 100000
 
+# scattering the rows of wide ranges is slower than comparing every row
+INDEX_MAX_FRACTION = 0.05
 
-def filter_all(
+# (dataset version, kind, name, value) -> (value, mask), least recently
+# used first
+_masks = OrderedDict()
+_masks_lock = threading.Lock()
+
+# (dataset version, name) -> (min, max) of the column
+_bounds = OrderedDict()
+BOUNDS_LIMIT = 256
+
+
+def range_mask(data_frame, name, value):
+    column = data_frame[name].to_numpy()
+    return (column >= value[0]) & (column <= value[1])
+
+
+def is_list_column(column):
+    return column.dtype == object and len(column.index) > 0 and \
+        isinstance(column.iloc[0], (list, tuple, np.ndarray))
+
+
+def code_mask(column, value):
+    # the selected values are mapped to category codes once, every row
+    # is then a lookup in a table indexed by its code
+    selected = column.cat.categories.get_indexer(pd.Index(value))
+    lookup = np.zeros(len(column.cat.categories)+1, dtype=bool)
+    lookup[selected[selected >= 0]] = True
+
+    # missing values have code -1 and hit the extra False entry
+    return lookup[column.cat.codes.to_numpy()]
+
+
+def list_mask(column, value):
+    # list cells as one flat value array with the row of every value,
+    # a row matches when any of its values is selected
+    cells = pa.array(column.to_numpy(), from_pandas=True)
+    flat = pc.list_flatten(cells)
+    rows = pc.list_parent_indices(cells).to_numpy()
+
+    member = pc.is_in(
+        flat, value_set=pa.array(value).cast(flat.type)
+    ).to_numpy(zero_copy_only=False)
+
+    mask = np.zeros(len(column.index), dtype=bool)
+    mask[rows[member]] = True
+    return mask
+
+
+def picker_mask(data_frame, name, value):
+    column = data_frame[name]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return code_mask(column, value)
+    elif is_list_column(column):
+        return list_mask(column, value)
+    else:
+        return column.isin(value).to_numpy()
+
+
+def is_indexed(data_frame, name):
+    return len(data_frame.index) >= INDEX_MIN_ROWS and \
+        pd.api.types.is_numeric_dtype(data_frame[name].dtype) and \
+        not pd.api.types.is_bool_dtype(data_frame[name].dtype)
+
+
+def column_bounds(version, data_frame, name):
+    key = (version, name)
+    with _masks_lock:
+        bounds = _bounds.get(key)
+        if bounds is not None:
+            _bounds.move_to_end(key)
+            return bounds
+
+    column = data_frame[name].to_numpy()
+    bounds = (np.nanmin(column), np.nanmax(column))
+    with _masks_lock:
+        _bounds[key] = bounds
+        while len(_bounds) > BOUNDS_LIMIT:
+            _bounds.popitem(last=False)
+    return bounds
+
+
+def is_narrow(version, data_frame, name, value):
+    # the index only pays off for ranges strictly inside the column that
+    # are estimated to hold a small part of its rows, default slider
+    # ranges never build one
+    lower, upper = column_bounds(version, data_frame, name)
+    if not upper > lower:
+        return False
+    if value[0] <= lower and value[1] >= upper:
+        return False
+    width = min(value[1], upper)-max(value[0], lower)
+    return width <= INDEX_MAX_FRACTION*(upper-lower)
+
+
+def indexed_range_mask(version, data_frame, name, value):
+    # the rows inside the range are one slice of the sorted column
+    order, values = read_index(
+        base_version(version), name, data_frame[name].to_numpy())
+    start = np.searchsorted(values, value[0], side='left')
+    stop = np.searchsorted(values, value[1], side='right')
+    if stop-start > INDEX_MAX_FRACTION*len(data_frame.index):
+        return range_mask(data_frame, name, value)
+
+    mask = np.zeros(len(data_frame.index), dtype=bool)
+    mask[order[start:stop]] = True
+    return mask
+
+
+def narrow_range_mask(data_frame, name, value, mask):
+    # only rows inside the wider cached range need to be compared again
+    rows = np.flatnonzero(mask)
+    column = data_frame[name].to_numpy()[rows]
+
+    narrowed = np.zeros(len(mask), dtype=bool)
+    narrowed[rows[(column >= value[0]) & (column <= value[1])]] = True
+    return narrowed
+
+
+def cached_mask(version, kind, data_frame, name, value):
+    # masks of columns without edits are shared by all views of a version
+    if name not in EDITED_COLUMNS:
+        version = base_version(version)
+
+    # request threads share the cache, masks are computed outside the
+    # lock on a snapshot of the entries
+    key = (version, kind, name, json.dumps(value, default=str))
+    with _masks_lock:
+        if key in _masks:
+            _masks.move_to_end(key)
+            return _masks[key][1]
+        entries = list(_masks.items())
+
+    mask = None
+    if kind == 'range' and is_indexed(data_frame, name) and \
+            is_narrow(version, data_frame, name, value):
+        mask = indexed_range_mask(version, data_frame, name, value)
+    elif kind == 'range':
+        for (c_version, c_kind, c_name, c_value), (
+                c_range, c_mask) in reversed(entries):
+            if (c_version, c_kind, c_name) == (version, kind, name) and \
+                    c_range[0] <= value[0] and value[1] <= c_range[1]:
+                mask = narrow_range_mask(data_frame, name, value, c_mask)
+                break
+
+    if mask is None:
+        if kind == 'range':
+            mask = range_mask(data_frame, name, value)
+        else:
+            mask = picker_mask(data_frame, name, value)
+
+    with _masks_lock:
+        _masks[key] = (value, mask)
+        cached = sum([c_mask.nbytes for c_value, c_mask in _masks.values()])
+        while cached > MASK_CACHE_BYTES and len(_masks) > 1:
+            c_value, c_mask = _masks.popitem(last=False)[1]
+            cached = cached-c_mask.nbytes
+
+    return mask
+
+
+def filter_mask(
         data_frame,
         numerical_key_list,
         numerical_key_values,
         categorical_key_list,
-        categorical_key_values
+        categorical_key_values,
+        version=None
 ):
-    filtered_table = data_frame
+    # every predicate is evaluated on the full column arrays and combined
+    # into one mask, rows are only gathered once by the caller
+    #
+    # with the dataset version given, the mask of every predicate is
+    # cached, so changing one control only evaluates that predicate,
+    # ranges of large numerical columns are resolved on a sorted index and
+    # narrowing other ranges only rescans the rows of the previous range
+    mask = np.ones(len(data_frame.index), dtype=bool)
     for filter_idx, filter_name in enumerate(numerical_key_list):
-        filtered_table = filter_range(
-            filtered_table,
-            filter_name,
-            numerical_key_values[filter_idx])
+        if version is None:
+            mask &= range_mask(
+                data_frame,
+                filter_name,
+                numerical_key_values[filter_idx])
+        else:
+            mask &= cached_mask(
+                version,
+                'range',
+                data_frame,
+                filter_name,
+                numerical_key_values[filter_idx])
 
     for filter_idx, filter_name in enumerate(categorical_key_list):
-        filtered_table = filter_picker(
-            filtered_table,
-            filter_name,
-            categorical_key_values[filter_idx])
+        if version is None:
+            mask &= picker_mask(
+                data_frame,
+                filter_name,
+                categorical_key_values[filter_idx])
+        else:
+            mask &= cached_mask(
+                version,
+                'picker',
+                data_frame,
+                filter_name,
+                categorical_key_values[filter_idx])
+
+    return mask
 
-    return filtered_table
+
+def filter_state(
+        numerical_key_list,
+        numerical_key_values,
+        categorical_key_list,
+        categorical_key_values
+):
+    state = hashlib.blake2b(digest_size=16)
+    state.update(json.dumps([
+        numerical_key_list,
+        numerical_key_values,
+        categorical_key_list,
+        categorical_key_values
+    ], default=str).encode())
+    return state.hexdigest()
+
+
+def row_dtype(length):
+    return np.uint32 if length < 2**32 else np.int64
+
+
+def filter_rows(
+        data_frame,
+        numerical_key_list,
+        numerical_key_values,
+        categorical_key_list,
+        categorical_key_values,
+        version=None
+):
+    # compact index of the selected rows, small enough to be shared
+    # between the processes instead of the filtered frame
+    return np.flatnonzero(filter_mask(
+        data_frame,
+        numerical_key_list,
+        numerical_key_values,
+        categorical_key_list,
+        categorical_key_values,
+        version
+    )).astype(row_dtype(len(data_frame.index)))
+
+
+def filter_range(data_frame, name, value):
+    return data_frame[
+        range_mask(data_frame, name, value)
+    ].reset_index(drop=True)
+
+
+def filter_picker(data_frame, name, value):
+    return data_frame[
+        picker_mask(data_frame, name, value)
+    ].reset_index(drop=True)
+
+
+def filter_all(
+        data_frame,
+        numerical_key_list,
+        numerical_key_values,
+        categorical_key_list,
+        categorical_key_values,
+        version=None
+):
+    return data_frame[filter_mask(
+        data_frame,
+        numerical_key_list,
+        numerical_key_values,
+        categorical_key_list,
+        categorical_key_values,
+        version
+    )].reset_index(drop=True)
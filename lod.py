@@ -0,0 +1,101 @@
+"""
+
+    Copyright (C) 2019 - 2020  Zhengyu Peng
+    E-mail: zpeng.me@gmail.com
+    Website: https://zpeng.me
+
+    `                      `
+    -:.                  -#:
+    -//:.              -###:
+    -////:.          -#####:
+    -/:.://:.      -###++##:
+    ..   `://:-  -###+. :##:
+           `:/+####+.   :##:
+    .::::::::/+###.     :##:
+    .////-----+##:    `:###:
+     `-//:.   :##:  `:###/.
+       `-//:. :##:`:###/.
+         `-//:+######/.
+           `-/+####/.
+             `+##+.
+              :##:
+              :##:
+              :##:
+              :##:
+              :##:
+               .+:
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# maximum number of points sent to the 3D view when all frames overlay
+POINT_BUDGET = int(os.environ.get('SENSORVIEW_POINT_BUDGET', 200000))
+
+# points of different colour buckets never share a voxel, so sparse
+# extreme values survive the downsampling
+COLOR_BUCKETS = 16
+
+# finest voxel grid per axis
+MAX_CELLS = 4096
+
+
+def color_buckets(colors, c_range, buckets=COLOR_BUCKETS):
+    if not pd.api.types.is_numeric_dtype(colors.dtype):
+        return pd.factorize(colors)[0] % buckets
+
+    if c_range[1] > c_range[0]:
+        scaled = (colors-c_range[0])/(c_range[1]-c_range[0])*buckets
+    else:
+        scaled = np.zeros(len(colors))
+    return np.clip(
+        np.nan_to_num(scaled), 0, buckets-1).astype(np.int64)
+
+
+def voxel_cells(values, bounds, cells):
+    lower, upper = bounds
+    if upper > lower:
+        scaled = (values-lower)/(upper-lower)*cells
+    else:
+        scaled = np.zeros(len(values))
+    return np.clip(np.nan_to_num(scaled), 0, cells-1).astype(np.int64)
+
+
+def downsample(points, bounds, colors=None, c_range=None,
+               budget=POINT_BUDGET):
+    # positions of the points kept, one point per occupied voxel of the
+    # finest grid over bounds that still fits the budget, a smaller
+    # volume therefore gets smaller voxels
+    count = len(points[0])
+    if count <= budget:
+        return np.arange(count)
+
+    if colors is None:
+        buckets = np.zeros(count, dtype=np.int64)
+    else:
+        buckets = color_buckets(colors, c_range)
+
+    kept = None
+    cells = max(1, int(np.cbrt(budget/COLOR_BUCKETS)))
+    while cells <= MAX_CELLS:
+        voxels = buckets
+        for values, axis_bounds in zip(points, bounds):
+            voxels = voxels*cells+voxel_cells(values, axis_bounds, cells)
+
+        # first point of every occupied voxel, hashed instead of sorted
+        first = np.flatnonzero(~pd.Series(voxels).duplicated().to_numpy())
+        if len(first) > budget:
+            break
+        kept = first
+        cells = int(cells*1.5)+1
+
+    if kept is None:
+        # even the coarsest grid is over budget, an even stride of its
+        # voxels is kept
+        kept = first[np.linspace(0, len(first)-1, budget).astype(np.int64)]
+
+    return kept
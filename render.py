@@ -0,0 +1,356 @@
+"""
+
+    Copyright (C) 2019 - 2020  Zhengyu Peng
+    E-mail: zpeng.me@gmail.com
+    Website: https://zpeng.me
+
+    `                      `
+    -:.                  -#:
+    -//:.              -###:
+    -////:.          -#####:
+    -/:.://:.      -###++##:
+    ..   `://:-  -###+. :##:
+           `:/+####+.   :##:
+    .::::::::/+###.     :##:
+    .////-----+##:    `:###:
+     `-//:.   :##:  `:###/.
+       `-//:. :##:`:###/.
+         `-//:+######/.
+           `-/+####/.
+             `+##+.
+              :##:
+              :##:
+              :##:
+              :##:
+              :##:
+               .+:
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+
+from dataset import list_data_files, load_dataset
+from viz.viz import get_animation_frames, get_animation_ranges
+from viz.viz import get_figure_layout, write_animation
+
+
+VIDEO_CODECS = {
+    'mp4': ['-c:v', 'libx264', '-pix_fmt', 'yuv420p'],
+    'webm': ['-c:v', 'libvpx-vp9', '-pix_fmt', 'yuv420p', '-b:v', '0',
+             '-crf', '32'],
+}
+
+# rasterized frames are named by the hash of their figure, so they are
+# only rendered again when something in the figure changed
+FRAME_CACHE = '.frames'
+
+
+def load_config(test_case_path):
+    config_file = os.path.join(test_case_path, 'config.json')
+    if not os.path.exists(config_file):
+        config_file = 'config.json'
+    with open(config_file, 'r') as read_file:
+        return json.load(read_file)
+
+
+def get_animation_keys(ui_config):
+    keys_dict = {**ui_config['categorical'], **ui_config['numerical']}
+    detections = ui_config['graph_3d_detections']
+    host = ui_config['graph_3d_host']
+    return dict(
+        x_key=keys_dict[detections['default_x']]['key'],
+        y_key=keys_dict[detections['default_y']]['key'],
+        z_key=keys_dict[detections['default_z']]['key'],
+        host_x_key=ui_config['host'][host['default_x']]['key'],
+        host_y_key=ui_config['host'][host['default_y']]['key'],
+        color_key=keys_dict[detections['default_color']]['key'],
+    ), keys_dict
+
+
+def render_frame(figure_json, file_name, width, height, scale):
+    # runs in a worker process, kaleido starts once per worker
+    partial = os.path.join(
+        os.path.dirname(file_name), '~'+os.path.basename(file_name))
+    pio.write_image(pio.from_json(figure_json, skip_invalid=True),
+                    partial,
+                    format='png',
+                    width=width,
+                    height=height,
+                    scale=scale)
+    os.replace(partial, file_name)
+    return file_name
+
+
+def iter_frame_figures(det_list, keys, color_key=None, db=False,
+                       colormap='Rainbow', height=720):
+    # one static figure per frame, without hover data and animation
+    # controls
+    if color_key is not None:
+        keys = dict(keys, color_key=color_key)
+    x_range, y_range, z_range, c_range = get_animation_ranges(
+        det_list,
+        keys['x_key'],
+        keys['y_key'],
+        keys['z_key'],
+        keys['host_x_key'],
+        keys['host_y_key'],
+        keys['color_key'])
+
+    for frame in get_animation_frames(
+            det_list,
+            keys['x_key'],
+            keys['y_key'],
+            keys['z_key'],
+            keys['host_x_key'],
+            keys['host_y_key'],
+            keys['color_key'],
+            None,
+            c_range,
+            db,
+            colormap):
+        yield to_json_plotly(dict(
+            data=frame['data'],
+            layout=get_figure_layout(
+                x_range,
+                y_range,
+                z_range,
+                height=height,
+                title='Frame: '+frame['name'],
+                margin=dict(l=0, r=0, b=0, t=40))))
+
+
+def render_frames(figures, cache_path, executor, width, height, scale,
+                  workers):
+    # frames are submitted as they are generated, at most two per worker
+    # are waiting so the figures of a long drive are never all in memory
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path, exist_ok=True)
+
+    frame_files = []
+    rendered = 0
+    pending = set()
+    for figure_json in figures:
+        frame_hash = hashlib.blake2b(
+            (figure_json+str((width, height, scale))).encode(),
+            digest_size=16).hexdigest()
+        file_name = os.path.join(cache_path, frame_hash+'.png')
+        frame_files.append(file_name)
+        if os.path.exists(file_name):
+            continue
+
+        if len(pending) >= 2*workers:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        pending.add(executor.submit(
+            render_frame, figure_json, file_name, width, height, scale))
+        rendered = rendered+1
+
+    for future in pending:
+        future.result()
+
+    return frame_files, rendered
+
+
+def encode_video(frame_files, output, fps=10, video_format='mp4',
+                 encoder='ffmpeg'):
+    if shutil.which(encoder) is None:
+        raise RuntimeError(encoder+' was not found')
+
+    # the cached frames are listed in playback order for the concat demuxer
+    list_file = output+'.txt'
+    with open(list_file, 'w') as frame_list:
+        for file_name in frame_files:
+            frame_list.write("file '"+os.path.abspath(file_name)+"'\n")
+            frame_list.write('duration '+str(1/fps)+'\n')
+
+    partial = os.path.join(
+        os.path.dirname(output), '~'+os.path.basename(output))
+    try:
+        subprocess.run(
+            [encoder, '-y', '-loglevel', 'error',
+             '-f', 'concat', '-safe', '0', '-i', list_file,
+             '-r', str(fps)] + VIDEO_CODECS[video_format] +
+            ['-f', video_format, partial],
+            check=True)
+        os.replace(partial, output)
+    finally:
+        os.remove(list_file)
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def render_file(data_file,
+                out_path,
+                keys,
+                keys_dict,
+                executor,
+                workers,
+                formats=['html', 'mp4'],
+                color_key=None,
+                fps=10,
+                width=1280,
+                height=720,
+                scale=1):
+    start = time.perf_counter()
+    outputs = []
+    rendered = 0
+    partial = None
+    try:
+        det_list = load_dataset(data_file)
+        name = os.path.splitext(os.path.basename(data_file))[0]
+
+        if 'html' in formats:
+            # the UI config may list keys of other sensors
+            hover_dict = {
+                key: item for key, item in keys_dict.items()
+                if item['key'] in det_list.columns
+            }
+            output = os.path.join(out_path, name+'.html')
+            partial = os.path.join(out_path, '~'+name+'.html')
+            write_animation(
+                det_list,
+                partial,
+                keys['x_key'],
+                keys['y_key'],
+                keys['z_key'],
+                keys['host_x_key'],
+                keys['host_y_key'],
+                color_key=keys['color_key'] if color_key is None
+                else color_key,
+                hover_dict=hover_dict,
+                title=name)
+            os.replace(partial, output)
+            outputs.append(output)
+
+        videos = [video_format for video_format in formats
+                  if video_format in VIDEO_CODECS]
+        if len(videos) > 0:
+            frame_files, rendered = render_frames(
+                iter_frame_figures(det_list, keys, color_key, height=height),
+                os.path.join(out_path, FRAME_CACHE),
+                executor,
+                width,
+                height,
+                scale,
+                workers)
+            for video_format in videos:
+                output = os.path.join(out_path, name+'.'+video_format)
+                encode_video(frame_files, output, fps, video_format)
+                outputs.append(output)
+
+        return dict(source=data_file,
+                    outputs=outputs,
+                    status='done',
+                    frames=rendered,
+                    elapsed=time.perf_counter()-start,
+                    error=None)
+    except Exception as err:
+        if partial is not None and os.path.exists(partial):
+            os.remove(partial)
+        return dict(source=data_file,
+                    outputs=outputs,
+                    status='failed',
+                    frames=rendered,
+                    elapsed=time.perf_counter()-start,
+                    error=repr(err))
+
+
+def print_result(result):
+    if result['status'] == 'failed':
+        print('[failed] {} ({:.1f} s): {}'.format(
+            result['source'], result['elapsed'], result['error']))
+    else:
+        print('[{}] {} -> {} ({:,} frames rendered, {:.1f} s)'.format(
+            result['status'], result['source'],
+            ', '.join(result['outputs']), result['frames'],
+            result['elapsed']))
+
+
+def render_batch(test_case_path,
+                 out_path=None,
+                 formats=['html', 'mp4'],
+                 color_key=None,
+                 workers=None,
+                 fps=10,
+                 width=1280,
+                 height=720,
+                 scale=1,
+                 verbose=True):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if out_path is None:
+        out_path = os.path.join(test_case_path, 'animations')
+    if not os.path.exists(out_path):
+        os.makedirs(out_path, exist_ok=True)
+
+    keys, keys_dict = get_animation_keys(load_config(test_case_path))
+
+    # files are rendered one after the other, the frames of each file are
+    # rasterized by the worker pool
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for data_file in list_data_files(test_case_path):
+            result = render_file(
+                os.path.join(test_case_path, data_file),
+                out_path,
+                keys,
+                keys_dict,
+                executor,
+                workers,
+                formats=formats,
+                color_key=color_key,
+                fps=fps,
+                width=width,
+                height=height,
+                scale=scale)
+            results.append(result)
+            if verbose:
+                print_result(result)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render an animation of every data file in a test case')
+    parser.add_argument('path', help='test case folder, e.g. ./data/drive1')
+    parser.add_argument('-o', '--out-path', default=None,
+                        help='output folder (default: <path>/animations)')
+    parser.add_argument('--formats', nargs='+', default=['html', 'mp4'],
+                        choices=['html']+list(VIDEO_CODECS))
+    parser.add_argument('--color', default=None,
+                        help='colour column (default: from the UI config)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--scale', type=float, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    batch_results = render_batch(args.path,
+                                 out_path=args.out_path,
+                                 formats=args.formats,
+                                 color_key=args.color,
+                                 workers=args.workers,
+                                 fps=args.fps,
+                                 width=args.width,
+                                 height=args.height,
+                                 scale=args.scale)
+
+    status = [result['status'] for result in batch_results]
+    print('{} rendered, {} failed in {:.1f} s'.format(
+        status.count('done'), status.count('failed'),
+        time.perf_counter()-start))
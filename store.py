@@ -0,0 +1,299 @@
+"""
+
+    Copyright (C) 2019 - 2020  Zhengyu Peng
+    E-mail: zpeng.me@gmail.com
+    Website: https://zpeng.me
+
+    `                      `
+    -:.                  -#:
+    -//:.              -###:
+    -////:.          -#####:
+    -/:.://:.      -###++##:
+    ..   `://:-  -###+. :##:
+           `:/+####+.   :##:
+    .::::::::/+###.     :##:
+    .////-----+##:    `:###:
+     `-//:.   :##:  `:###/.
+       `-//:. :##:`:###/.
+         `-//:+######/.
+           `-/+####/.
+             `+##+.
+              :##:
+              :##:
+              :##:
+              :##:
+              :##:
+               .+:
+
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pyarrow as pa
+
+from dataset import to_table
+
+
+# every version of a dataset is an immutable Arrow IPC file, the worker
+# processes map it read-only and only a version string goes through Redis
+STORE_PATH = os.environ.get(
+    'SENSORVIEW_STORE',
+    os.path.join(tempfile.gettempdir(), 'sensorview'))
+
+# total size of the version files before the least recently used ones
+# are evicted
+STORE_LIMIT = int(os.environ.get('SENSORVIEW_STORE_LIMIT', 4*1024**3))
+
+# number of versions each process keeps mapped
+MAPPED_LIMIT = 4
+
+# number of sorted column indexes each process keeps mapped
+INDEX_LIMIT = 16
+
+# version -> DataFrame mapped by this process, least recently used first
+_mapped = OrderedDict()
+
+# (version, column) -> (order, sorted values), least recently used first
+_indexes = OrderedDict()
+
+# both caches are shared by the request threads of a process
+_cache_lock = threading.Lock()
+
+
+# the only columns changed by session edits, a view of a version with
+# edits shares everything else with the version
+EDITED_COLUMNS = ['Visibility']
+
+
+def base_version(version):
+    # views with session edits are named version/revision
+    return version.split('/')[0]
+
+
+def content_hash(file_name, block_size=1024*1024):
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file_name, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def dataset_version(file_hash, columns, sort_key=''):
+    # datasets loaded from identical files with the same columns and row
+    # order share a version, edited datasets get a new random version
+    key = hashlib.blake2b(digest_size=16)
+    key.update(file_hash.encode())
+    for column in sorted(columns):
+        key.update(b'\0'+column.encode())
+    key.update(b'\1'+sort_key.encode())
+    return key.hexdigest()
+
+
+def serialize(data, compression=None):
+    # Arrow IPC stream of a DataFrame, compression can be None, 'lz4'
+    # or 'zstd'
+    table = to_table(data)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(
+            sink,
+            table.schema,
+            options=pa.ipc.IpcWriteOptions(compression=compression)
+    ) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def deserialize(buffer):
+    # uncompressed numerical columns are views on the buffer, compressed
+    # streams are decompressed once
+    table = pa.ipc.open_stream(pa.py_buffer(buffer)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def version_file(version, path=STORE_PATH):
+    return os.path.join(path, version+'.arrow')
+
+
+def partial_file(file_name):
+    # unique per writer, processes loading the same version at the same
+    # time never write into each other's file
+    return os.path.join(
+        os.path.dirname(file_name),
+        '~'+uuid.uuid4().hex+'.'+os.path.basename(file_name))
+
+
+def has_version(version, path=STORE_PATH):
+    return os.path.exists(version_file(version, path))
+
+
+def write_version(data, version=None, path=STORE_PATH):
+    if not os.path.exists(path):
+        os.makedirs(path, exist_ok=True)
+
+    if version is None:
+        version = uuid.uuid4().hex
+    table = to_table(data)
+
+    # written uncompressed so readers can map the buffers without a copy,
+    # the rename makes the file appear complete to the other workers
+    partial = partial_file(version_file(version, path))
+    try:
+        with pa.OSFile(partial, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(partial, version_file(version, path))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    return version
+
+
+def read_version(version, path=STORE_PATH):
+    file_name = version_file(version, path)
+
+    with _cache_lock:
+        data = _mapped.get(version)
+        if data is not None:
+            _mapped.move_to_end(version)
+
+    if data is None:
+        source = pa.memory_map(file_name, 'r')
+        table = pa.ipc.open_file(source).read_all()
+
+        # numerical columns without nulls stay views on the mapped file
+        data = table.to_pandas(split_blocks=True)
+        with _cache_lock:
+            _mapped[version] = data
+            while len(_mapped) > MAPPED_LIMIT:
+                _mapped.popitem(last=False)
+
+    # the modification time is the last access for the eviction
+    try:
+        os.utime(file_name)
+    except OSError:
+        pass
+
+    return data
+
+
+def index_file(version, column, path=STORE_PATH):
+    column_hash = hashlib.blake2b(column.encode(), digest_size=8)
+    return os.path.join(
+        path, version+'.'+column_hash.hexdigest()+'.index')
+
+
+def write_index(version, column, values, path=STORE_PATH):
+    # permutation sorting the column plus the sorted values, NaN last
+    order = np.argsort(values, kind='stable')
+    order = order.astype(np.uint32 if len(order) < 2**32 else np.int64)
+    table = pa.table({'Order': order, 'Values': values[order]})
+
+    partial = partial_file(index_file(version, column, path))
+    try:
+        with pa.OSFile(partial, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(partial, index_file(version, column, path))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def read_index(version, column, values, path=STORE_PATH):
+    # built by the first process filtering the column of this version,
+    # every other process maps the same file
+    key = (version, column)
+    with _cache_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+
+    file_name = index_file(version, column, path)
+    if not os.path.exists(file_name):
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        write_index(version, column, values, path)
+
+    table = pa.ipc.open_file(pa.memory_map(file_name, 'r')).read_all()
+    index = (
+        table.column('Order').to_numpy(),
+        table.column('Values').to_numpy())
+    with _cache_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_LIMIT:
+            _indexes.popitem(last=False)
+
+    return index
+
+
+def evict_versions(keep=[], limit=STORE_LIMIT, path=STORE_PATH):
+    if not os.path.exists(path):
+        return []
+
+    versions = {}
+    index_sizes = {}
+    for file in os.listdir(path):
+        # files starting with ~ are still being written
+        if file.startswith('~'):
+            continue
+        try:
+            stat = os.stat(os.path.join(path, file))
+        except OSError:
+            continue
+        if file.endswith('.arrow'):
+            versions[file[:-6]] = (stat.st_mtime, stat.st_size)
+        elif file.endswith('.index'):
+            # column indexes are evicted together with their version
+            version = file.split('.')[0]
+            index_sizes.setdefault(version, []).append(
+                (file, stat.st_size))
+
+    total = sum([size for mtime, size in versions.values()]) + \
+        sum([size for files in index_sizes.values()
+             for file, size in files])
+    evicted = []
+    for mtime, size, version in sorted(
+            [(mtime, size, version)
+             for version, (mtime, size) in versions.items()]):
+        if total <= limit:
+            break
+        if version in keep:
+            continue
+        try:
+            # workers that already mapped the version keep their mapping
+            os.remove(version_file(version, path))
+        except OSError:
+            # still mapped by a worker on platforms that lock mapped
+            # files, it is tried again with the next eviction
+            continue
+        total = total-size
+        for file, index_size in index_sizes.get(version, []):
+            try:
+                os.remove(os.path.join(path, file))
+                total = total-index_size
+            except OSError:
+                pass
+        evicted.append(version)
+
+    return evicted
+
+
+def store_size(path=STORE_PATH):
+    if not os.path.exists(path):
+        return 0
+
+    total = 0
+    for file in os.listdir(path):
+        try:
+            total = total+os.path.getsize(os.path.join(path, file))
+        except OSError:
+            pass
+    return total
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from annotations import append_annotations, label_mask  # noqa: E402
+
+
+def test_label_mask_without_log(tmp_path):
+    mask = label_mask(str(tmp_path), 'f.parquet', 10, 'hidden')
+    assert mask.dtype == bool
+    assert not mask.any()
+
+
+def test_label_mask_without_records_of_file(tmp_path):
+    append_annotations(str(tmp_path), 'other.parquet', [1], 'hidden')
+    mask = label_mask(str(tmp_path), 'f.parquet', 10, 'hidden')
+    assert not mask.any()
+
+
+def test_label_mask_last_label(tmp_path):
+    append_annotations(str(tmp_path), 'f.parquet', [1, 3, 12], 'hidden')
+    append_annotations(str(tmp_path), 'f.parquet', [3], 'visible')
+    mask = label_mask(str(tmp_path), 'f.parquet', 10, 'hidden')
+    assert np.flatnonzero(mask).tolist() == [1]
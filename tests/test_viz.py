@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from viz.viz import get_histogram, histogram_bins  # noqa: E402
+
+
+def test_histogram_bins_of_discrete_column():
+    values = np.array([0.0]*15+[1.0]*70+[2.0]*15)
+    edges = histogram_bins(values)
+    assert np.allclose(edges, [-0.5, 0.5, 1.5, 2.5])
+
+
+def test_histogram_bins_of_continuous_column_with_zero_iqr():
+    values = np.concatenate([np.zeros(70), np.linspace(0.1, 5.3, 30)])
+    assert len(histogram_bins(values))-1 > 1
+
+
+def test_histogram_of_discrete_column():
+    det_list = pd.DataFrame({'LookType': [0]*15+[1]*70+[2]*15})
+    trace = get_histogram(det_list, 'LookType')['data'][0]
+    assert np.allclose(trace['x'], [0, 1, 2])
+    assert np.allclose(trace['y'], [0.15, 0.7, 0.15])
@@ -1,206 +1,499 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import h5py
 import os
 import numpy as np
 import pandas as pd
 
+from dataset import DATA_FORMATS, open_writer, save_dataset, to_table
 
-def unpack_detections(path,
-                      file_name,
-                      data_type='session',
-                      save_list=True,
-                      duty_cycle=60e-3):
-    c_look_names = ['MRLL', 'MRML', 'LRLL', 'LRML']
-    c_firing_order = [0, 2, 1, 3]
 
-    f = h5py.File(os.path.join(path, file_name), 'r')
+C_LOOK_NAMES = ['MRLL', 'MRML', 'LRLL', 'LRML']
+C_FIRING_ORDER = [0, 2, 1, 3]
+
+# default CR response used when the calibration table has no entry
+C_CR_RESP_DEFAULT = 4.645275098003292e+03
 
+DET_COLUMNS = [
+    'Frame',
+    'SubFrame',
+    'LookType',
+    'LookName',
+    'Range',
+    'Speed',
+    'UnfoldedSpeed',
+    'DoppShift',
+    'DoppUnfoldFlag',
+    'Azimuth',
+    'Elevation',
+    'AzConf',
+    'ElConf',
+    'AFType',
+    'Amplitude',
+    'SNR',
+    'RCS',
+    'VehYawRate',
+    'VehSpeed',
+]
+
+DET_DTYPES = {
+    'LookName': object,
+    'AFType': object,
+}
+
+
+def get_frame_size(f, data_type='session'):
+    if data_type == 'session':
+        return int(f['sess_data']['numFiles'][0, 0])
+    elif data_type == 'plotdata':
+        return np.shape(f['plotData'])[0]
+
+
+def decode_frame(f, frame_idx, data_type='session'):
     if data_type == 'session':
         session_data = f['sess_data']
-        # frame_size = np.shape(session_data['plotData'])[1]
-        frame_size = int(session_data['numFiles'][0,0])
-        # print(frame_size)
+        single_frame = f[session_data['plotData'][0, frame_idx]]
     elif data_type == 'plotdata':
-        frame_size = np.shape(f['plotData'])[0]
-
-    frame = pd.Series(dtype=int)
-    look_type_idx = pd.Series(dtype=int)
-    look_type_name = pd.Series(dtype=object)
-    rng = pd.Series()
-    speed = pd.Series()
-    unfolded_speed = pd.Series()
-    az = pd.Series()
-    el = pd.Series()
-    az_conf = pd.Series(dtype=int)
-    el_conf = pd.Series(dtype=int)
-    amp = pd.Series()
-    snr = pd.Series()
-    af_type = pd.Series(dtype=object)
-    rcs = pd.Series()
-    sub_frame = pd.Series()
-    veh_speed = pd.Series()
-    veh_yaw_rate = pd.Series()
-    dopp_shift = pd.Series()
-    dopp_unfold_flag = pd.Series(dtype=int)
-
-    for frame_idx in range(0, frame_size):
-        # try:
-        if data_type == 'session':
-            single_frame = f[session_data['plotData'][0, frame_idx]]
-        elif data_type == 'plotdata':
-            single_frame = f[f['plotData'][frame_idx, 0]]
-
-        if np.shape(single_frame)[0] > 2:
-
-            look_type_temp = single_frame['look'][()][0, 0]
-            if data_type == 'session':
-                frame_str = (
-                    (
-                        f[session_data['RawDataFile'][frame_idx, 0]][()]-48
-                    ).ravel())[22:]
-            elif data_type == 'plotdata':
-                frame_str = (
-                    (single_frame['RawDataFile'][()]-48).ravel())[22:-4]
-
-            frame_temp = int(str(frame_str)[1:-1].replace(" ", ""))
-
-            num_det = single_frame['afData']['numDets'][()][0, 0]
-            cr_resp = single_frame['rdd2Data']['CR_Resp'][()][0, :]
-            veh_speed_temp = single_frame['speed'][()][0, 0]
-            veh_yaw_rate_temp = single_frame['yaw'][()][0, 0]
-
-            vun = single_frame['rdd2Data']['rdd_output']['Vun'][()][0, 0]
-
-            if num_det > 0:
-                for rdop_det_idx in range(0, int(num_det)):
-                    single_det = f[single_frame['afData']
-                                   ['af_output'][rdop_det_idx, 0]]
-                    rng_temp = pd.Series(single_det['range'][()][0, :])
-                    speed_temp = pd.Series(single_det['range_rate'][()][0, :])
-                    az_temp = pd.Series(single_det['az'][()][0, :])
-                    el_temp = pd.Series(single_det['el'][()][0, :])
-                    az_conf_temp = pd.Series(single_det['az_conf'][()][0, :])
-                    el_conf_temp = pd.Series(single_det['el_conf'][()][0, :])
-                    af_type_temp = pd.Series(
-                        np.zeros_like(az_temp, dtype=object))
-                    af_type_temp[:] = single_det['type'][()][:, 0].astype(
-                        np.uint8).tostring().decode("ascii")
-                    amp_temp = pd.Series(
-                        20*np.log10(single_det['rdop_amp'][()][0, :]))
-                    snr_temp = pd.Series(single_det['SNR'][()][0, :])
-                    dopp_shift_temp = pd.Series(
-                        single_det['Dopp_shift'][()][0, :])
-                    dopp_unfold_flag_temp = pd.Series(
-                        single_det['flag_Doppler_Unfolding_fail_vec'][()][0, :]
-                    )
-
-                    if single_det['flag_Doppler_Unfolding_fail'][()][0, 0] == 0:
-                        unfolded_speed_temp = speed_temp-speed_temp / \
-                            np.abs(speed_temp)*vun*dopp_shift_temp/np.pi
-                    else:
-                        unfolded_speed_temp = speed_temp
-
-                    look_name_temp = pd.Series(
-                        np.zeros_like(snr_temp, dtype=object))
-                    look_name_temp[:] = c_look_names[int(look_type_temp-1)]
-                    sub_frame_temp = pd.Series(np.ones_like(
-                        snr_temp))*c_firing_order[int(look_type_temp-1)]
-
-                    rng_bin_temp = single_det['rindx'][()][0, :]
-                    cr_resp_temp = cr_resp[int(rng_bin_temp[0])-1]
-                    if cr_resp_temp == 0:
-                        cr_resp_temp = 4.645275098003292e+03
-
-                    cr = pd.Series(
-                        20*np.log10((np.ones_like(rng_temp)*cr_resp_temp)))
-
-                    rcs_temp = amp_temp-cr
-
-                    rng = rng.append(rng_temp, ignore_index=True)
-                    speed = speed.append(speed_temp, ignore_index=True)
-                    unfolded_speed = unfolded_speed.append(
-                        unfolded_speed_temp, ignore_index=True)
-                    dopp_shift = dopp_shift.append(
-                        dopp_shift_temp, ignore_index=True)
-                    dopp_unfold_flag = dopp_unfold_flag.append(
-                        dopp_unfold_flag_temp, ignore_index=True)
-
-                    az = az.append(az_temp, ignore_index=True)
-                    el = el.append(el_temp, ignore_index=True)
-                    az_conf = az_conf.append(az_conf_temp, ignore_index=True)
-                    el_conf = el_conf.append(el_conf_temp, ignore_index=True)
-                    af_type = af_type.append(af_type_temp, ignore_index=True)
-                    amp = amp.append(amp_temp, ignore_index=True)
-                    snr = snr.append(snr_temp, ignore_index=True)
-                    rcs = rcs.append(rcs_temp, ignore_index=True)
-                    look_type_name = look_type_name.append(
-                        look_name_temp, ignore_index=True)
-                    look_type_idx = look_type_idx.append(
-                        pd.Series(np.ones_like(rng_temp)*look_type_temp),
-                        ignore_index=True)
-                    frame = frame.append(pd.Series(np.ones_like(
-                        rng_temp)*frame_temp), ignore_index=True)
-                    sub_frame = sub_frame.append(
-                        sub_frame_temp, ignore_index=True)
-                    veh_speed = veh_speed.append(
-                        pd.Series(np.ones_like(rng_temp)*veh_speed_temp),
-                        ignore_index=True)
-                    veh_yaw_rate = veh_yaw_rate.append(
-                        pd.Series(np.ones_like(rng_temp)*veh_yaw_rate_temp),
-                        ignore_index=True)
-        # except Exception:
-        #     print("Missing data"+str(frame_idx))
+        single_frame = f[f['plotData'][frame_idx, 0]]
 
-    det_list = pd.DataFrame()
+    # empty frames are stored as a [0, 0] placeholder
+    if np.shape(single_frame)[0] <= 2:
+        return None
+
+    look_type = single_frame['look'][()][0, 0]
+    if data_type == 'session':
+        frame_str = (
+            (
+                f[session_data['RawDataFile'][frame_idx, 0]][()]-48
+            ).ravel())[22:]
+    elif data_type == 'plotdata':
+        frame_str = (
+            (single_frame['RawDataFile'][()]-48).ravel())[22:-4]
+
+    frame_num = int(''.join(str(int(digit)) for digit in frame_str))
+
+    num_det = int(single_frame['afData']['numDets'][()][0, 0])
+    if num_det <= 0:
+        return None
+
+    cr_resp = single_frame['rdd2Data']['CR_Resp'][()][0, :]
+    veh_speed = single_frame['speed'][()][0, 0]
+    veh_yaw_rate = single_frame['yaw'][()][0, 0]
+    vun = single_frame['rdd2Data']['rdd_output']['Vun'][()][0, 0]
+
+    look_name = C_LOOK_NAMES[int(look_type-1)]
+    sub_frame = C_FIRING_ORDER[int(look_type-1)]
+
+    chunks = {key: [] for key in DET_COLUMNS}
+    for rdop_det_idx in range(0, num_det):
+        single_det = f[single_frame['afData']
+                       ['af_output'][rdop_det_idx, 0]]
+
+        rng = single_det['range'][()][0, :]
+        speed = single_det['range_rate'][()][0, :]
+        dopp_shift = single_det['Dopp_shift'][()][0, :]
+        amp = 20*np.log10(single_det['rdop_amp'][()][0, :])
+        num = rng.shape[0]
 
-    det_list['Frame'] = frame
-    det_list['SubFrame'] = sub_frame
-    det_list['LookType'] = look_type_idx
-    det_list['LookName'] = look_type_name
-    det_list['Range'] = rng
-    det_list['Speed'] = speed
-    det_list['UnfoldedSpeed'] = unfolded_speed
-    det_list['DoppShift'] = dopp_shift
-    det_list['DoppUnfoldFlag'] = dopp_unfold_flag
-    det_list['Azimuth'] = az
-    det_list['Elevation'] = el
-    det_list['AzConf'] = az_conf
-    det_list['ElConf'] = el_conf
-    det_list['AFType'] = af_type
-    det_list['Amplitude'] = amp
-    det_list['SNR'] = snr
-    det_list['RCS'] = rcs
-    det_list['VehYawRate'] = veh_yaw_rate
-    det_list['VehSpeed'] = veh_speed
+        if single_det['flag_Doppler_Unfolding_fail'][()][0, 0] == 0:
+            unfolded_speed = speed-speed / \
+                np.abs(speed)*vun*dopp_shift/np.pi
+        else:
+            unfolded_speed = speed
+
+        rng_bin = single_det['rindx'][()][0, :]
+        cr_resp_temp = cr_resp[int(rng_bin[0])-1]
+        if cr_resp_temp == 0:
+            cr_resp_temp = C_CR_RESP_DEFAULT
+
+        af_type = single_det['type'][()][:, 0].astype(
+            np.uint8).tobytes().decode('ascii')
+
+        chunks['Frame'].append(np.full(num, frame_num, dtype=float))
+        chunks['SubFrame'].append(np.full(num, sub_frame, dtype=float))
+        chunks['LookType'].append(np.full(num, look_type, dtype=float))
+        chunks['LookName'].append(np.full(num, look_name, dtype=object))
+        chunks['Range'].append(rng)
+        chunks['Speed'].append(speed)
+        chunks['UnfoldedSpeed'].append(unfolded_speed)
+        chunks['DoppShift'].append(dopp_shift)
+        chunks['DoppUnfoldFlag'].append(
+            single_det['flag_Doppler_Unfolding_fail_vec'][()][0, :])
+        chunks['Azimuth'].append(single_det['az'][()][0, :])
+        chunks['Elevation'].append(single_det['el'][()][0, :])
+        chunks['AzConf'].append(single_det['az_conf'][()][0, :])
+        chunks['ElConf'].append(single_det['el_conf'][()][0, :])
+        chunks['AFType'].append(np.full(num, af_type, dtype=object))
+        chunks['Amplitude'].append(amp)
+        chunks['SNR'].append(single_det['SNR'][()][0, :])
+        chunks['RCS'].append(amp-20*np.log10(cr_resp_temp))
+        chunks['VehYawRate'].append(np.full(num, veh_yaw_rate, dtype=float))
+        chunks['VehSpeed'].append(np.full(num, veh_speed, dtype=float))
+
+    return {key: np.concatenate(chunks[key]) for key in DET_COLUMNS}
+
+
+def concat_frames(frames):
+    # frames is a list of the column dicts returned by decode_frame,
+    # every column is concatenated exactly once
+    det_list = pd.DataFrame()
+    for key in DET_COLUMNS:
+        dtype = DET_DTYPES.get(key, float)
+        if len(frames) > 0:
+            det_list[key] = np.concatenate(
+                [single[key] for single in frames]).astype(dtype, copy=False)
+        else:
+            det_list[key] = np.array([], dtype=dtype)
 
     det_list = det_list.sort_values(
-        ['Frame', 'SubFrame'], ascending=[True, True])
-    det_list = det_list.reset_index(drop=True)
-
-    temp_frame = 4*det_list['Frame']+det_list['SubFrame']
-    jump_position = temp_frame - \
-        pd.concat([pd.Series(temp_frame[0]), temp_frame[0:-1]],
-                  ignore_index=True)
-    veh_angle = (det_list['VehYawRate']*duty_cycle*jump_position).cumsum()
-    veh_x = (det_list['VehSpeed']*duty_cycle*jump_position *
-             np.sin(veh_angle/180*np.pi)).cumsum()
-    veh_y = (veh_speed*duty_cycle*jump_position *
-             np.cos(veh_angle/180*np.pi)).cumsum()
-
-    det_list['Latitude'] = -det_list['Range'] * \
-        np.sin((det_list['Azimuth']+veh_angle)/180*np.pi) * \
-        np.cos(det_list['Elevation']/180*np.pi) - veh_x
-    det_list['Longitude'] = det_list['Range'] * \
-        np.cos((det_list['Azimuth']+veh_angle)/180*np.pi) * \
-        np.cos(det_list['Elevation']/180*np.pi) + veh_y
-    det_list['Height'] = -det_list['Range'] * \
-        np.sin(det_list['Elevation']/180*np.pi)
+        ['Frame', 'SubFrame'], ascending=[True, True], kind='mergesort')
+    return det_list.reset_index(drop=True)
+
+
+def add_ego_motion(det_list, duty_cycle=60e-3, state=None):
+    # state carries the integration across chunk boundaries, it is read
+    # and updated in place when given
+    if state is None:
+        state = {}
+
+    temp_frame = (4*det_list['Frame']+det_list['SubFrame']).to_numpy()
+    jump_position = np.diff(
+        temp_frame, prepend=state.get('temp_frame', temp_frame[:1]))
+
+    veh_angle = state.get('veh_angle', 0.0)+np.cumsum(
+        det_list['VehYawRate'].to_numpy()*duty_cycle*jump_position)
+    veh_step = det_list['VehSpeed'].to_numpy()*duty_cycle*jump_position
+    veh_x = state.get('veh_x', 0.0) + \
+        np.cumsum(veh_step*np.sin(veh_angle/180*np.pi))
+    veh_y = state.get('veh_y', 0.0) + \
+        np.cumsum(veh_step*np.cos(veh_angle/180*np.pi))
+
+    rng = det_list['Range'].to_numpy()
+    az = (det_list['Azimuth'].to_numpy()+veh_angle)/180*np.pi
+    el = det_list['Elevation'].to_numpy()/180*np.pi
+
+    det_list['Latitude'] = -rng*np.sin(az)*np.cos(el) - veh_x
+    det_list['Longitude'] = rng*np.cos(az)*np.cos(el) + veh_y
+    det_list['Height'] = -rng*np.sin(el)
     det_list['VehYaw'] = veh_angle
     det_list['VehLat'] = -veh_x
     det_list['VehLong'] = veh_y
 
-    det_list = det_list.reset_index(drop=True)
+    if len(temp_frame) > 0:
+        state['temp_frame'] = temp_frame[-1:]
+        state['veh_angle'] = veh_angle[-1]
+        state['veh_x'] = veh_x[-1]
+        state['veh_y'] = veh_y[-1]
+
+    return det_list
+
+
+def decode_frames(file_path, start, stop, data_type='session'):
+    # every call opens its own handle, so shards can be decoded in
+    # separate processes without sharing h5py state
+    frames = []
+    with h5py.File(file_path, 'r') as f:
+        for frame_idx in range(start, stop):
+            single = decode_frame(f, frame_idx, data_type)
+            if single is not None:
+                frames.append(single)
+    return frames
+
+
+def split_frames(frame_size, shards):
+    bounds = np.linspace(0, frame_size, max(shards, 1)+1).astype(int)
+    return [(bounds[idx], bounds[idx+1])
+            for idx in range(0, len(bounds)-1)
+            if bounds[idx+1] > bounds[idx]]
+
+
+def unpack_detections(path,
+                      file_name,
+                      data_type='session',
+                      save_list=True,
+                      duty_cycle=60e-3,
+                      shards=1,
+                      file_format='parquet'):
+    file_path = os.path.join(path, file_name)
+
+    with h5py.File(file_path, 'r') as f:
+        frame_size = get_frame_size(f, data_type)
+
+    frame_ranges = split_frames(frame_size, shards)
+    if len(frame_ranges) > 1:
+        with ProcessPoolExecutor(max_workers=len(frame_ranges)) as executor:
+            futures = [
+                executor.submit(decode_frames, file_path,
+                                start, stop, data_type)
+                for start, stop in frame_ranges
+            ]
+            # shards are merged in frame order, concat_frames then sorts
+            # by Frame/SubFrame before the ego-motion integration
+            frames = [single
+                      for future in futures
+                      for single in future.result()]
+    else:
+        frames = decode_frames(file_path, 0, frame_size, data_type)
+
+    det_list = add_ego_motion(concat_frames(frames), duty_cycle)
 
     if save_list:
-        det_list.to_pickle(file_name[:-4]+'.pkl')
+        save_dataset(det_list, file_name[:-4]+DATA_FORMATS[file_format])
 
     return det_list
+
+
+def iter_detections(path,
+                    file_name,
+                    data_type='session',
+                    chunk_frames=500,
+                    duty_cycle=60e-3):
+    # yields the detections of every chunk_frames recorded frames, rows
+    # and ego-motion match unpack_detections as long as the recording is
+    # stored in frame order
+    state = {}
+    offset = 0
+    carry = []
+
+    with h5py.File(os.path.join(path, file_name), 'r') as f:
+        frame_size = get_frame_size(f, data_type)
+
+        for start in range(0, frame_size, chunk_frames):
+            stop = min(start+chunk_frames, frame_size)
+
+            frames = carry
+            for frame_idx in range(start, stop):
+                single = decode_frame(f, frame_idx, data_type)
+                if single is not None:
+                    frames.append(single)
+            carry = []
+
+            if len(frames) == 0:
+                continue
+
+            det_list = concat_frames(frames)
+
+            # sub frames of the last frame may still follow in the next
+            # chunk, hold them back so the Frame/SubFrame order is kept
+            if stop < frame_size:
+                last = det_list['Frame'].to_numpy() == \
+                    det_list['Frame'].iloc[-1]
+                carry = [{key: det_list[key].to_numpy()[last]
+                          for key in DET_COLUMNS}]
+                det_list = det_list[~last].reset_index(drop=True)
+
+                if len(det_list.index) == 0:
+                    continue
+
+            det_list = add_ego_motion(det_list, duty_cycle, state)
+            det_list.index = det_list.index+offset
+            offset = offset+len(det_list.index)
+
+            yield det_list
+
+
+def unpack_stream(path,
+                  file_name,
+                  out_file,
+                  data_type='session',
+                  chunk_frames=500,
+                  duty_cycle=60e-3):
+    # appends one Parquet row group, or one Arrow IPC record batch,
+    # per chunk so only a single chunk is held in memory
+    writer = None
+    categories = {}
+    rows = 0
+    try:
+        for det_list in iter_detections(path,
+                                        file_name,
+                                        data_type=data_type,
+                                        chunk_frames=chunk_frames,
+                                        duty_cycle=duty_cycle):
+            table = to_table(det_list, categories)
+            if writer is None:
+                writer = open_writer(out_file, table.schema)
+            writer.write_table(table)
+            rows = rows+table.num_rows
+
+        if writer is None:
+            table = to_table(add_ego_motion(concat_frames([])))
+            writer = open_writer(out_file, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows
+
+
+def find_source_files(path, ext='.mat'):
+    sources = []
+    for r, d, f in os.walk(path):
+        for file in sorted(f):
+            if file.endswith(ext):
+                sources.append(os.path.join(r, file))
+    return sorted(sources)
+
+
+def output_file_name(source, out_path=None, root=None, ext='.parquet'):
+    base_name = os.path.splitext(source)[0]+ext
+    if out_path is None:
+        return base_name
+    return os.path.join(out_path, os.path.relpath(base_name, root))
+
+
+def is_up_to_date(source, output):
+    return os.path.exists(output) and \
+        os.path.getmtime(output) >= os.path.getmtime(source)
+
+
+def convert_file(source,
+                 output,
+                 data_type='session',
+                 duty_cycle=60e-3,
+                 shards=1,
+                 chunk_frames=None):
+    start = time.perf_counter()
+
+    # write to a temporary name first so an interrupted run never
+    # leaves a truncated file that looks up to date
+    out_dir = os.path.dirname(output)
+    partial = os.path.join(out_dir, '~'+os.path.basename(output))
+    try:
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir, exist_ok=True)
+
+        if chunk_frames:
+            rows = unpack_stream(
+                os.path.dirname(source),
+                os.path.basename(source),
+                partial,
+                data_type=data_type,
+                chunk_frames=chunk_frames,
+                duty_cycle=duty_cycle)
+        else:
+            det_list = unpack_detections(
+                os.path.dirname(source),
+                os.path.basename(source),
+                data_type=data_type,
+                save_list=False,
+                duty_cycle=duty_cycle,
+                shards=shards)
+            save_dataset(det_list, partial)
+            rows = len(det_list.index)
+
+        os.replace(partial, output)
+
+        return dict(source=source,
+                    output=output,
+                    status='done',
+                    rows=rows,
+                    elapsed=time.perf_counter()-start,
+                    error=None)
+    except Exception as err:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return dict(source=source,
+                    output=output,
+                    status='failed',
+                    rows=0,
+                    elapsed=time.perf_counter()-start,
+                    error=repr(err))
+
+
+def print_result(result):
+    if result['status'] == 'failed':
+        print('[failed] {} ({:.1f} s): {}'.format(
+            result['source'], result['elapsed'], result['error']))
+    else:
+        print('[{}] {} -> {} ({:,} rows, {:.1f} s)'.format(
+            result['status'], result['source'], result['output'],
+            result['rows'], result['elapsed']))
+
+
+def unpack_batch(path,
+                 out_path=None,
+                 data_type='session',
+                 duty_cycle=60e-3,
+                 workers=None,
+                 shards=1,
+                 chunk_frames=None,
+                 file_format='parquet',
+                 overwrite=False,
+                 verbose=True):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if chunk_frames and file_format == 'pkl':
+        raise ValueError('Streaming needs a Parquet or Arrow output format')
+    ext = DATA_FORMATS[file_format]
+
+    jobs = []
+    results = []
+    for source in find_source_files(path):
+        output = output_file_name(source, out_path, path, ext)
+        if not overwrite and is_up_to_date(source, output):
+            results.append(dict(source=source,
+                                output=output,
+                                status='skipped',
+                                rows=0,
+                                elapsed=0.0,
+                                error=None))
+        else:
+            jobs.append((source, output))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(convert_file, source, output,
+                            data_type, duty_cycle, shards, chunk_frames)
+            for source, output in jobs
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if verbose:
+                print_result(result)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert radar .mat recordings into detection lists')
+    parser.add_argument('path', nargs='?', default='./data/',
+                        help='folder searched recursively for .mat files')
+    parser.add_argument('-o', '--out-path', default=None,
+                        help='output folder (default: next to the source)')
+    parser.add_argument('-t', '--data-type', default='session',
+                        choices=['session', 'plotdata'])
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('-s', '--shards', type=int, default=1,
+                        help='decode each file in this many parallel shards')
+    parser.add_argument('-c', '--chunk-frames', type=int, default=None,
+                        help='stream every N frames into the output file')
+    parser.add_argument('--format', default='parquet',
+                        choices=list(DATA_FORMATS),
+                        help='output format (pkl is kept for legacy tools)')
+    parser.add_argument('--duty-cycle', type=float, default=60e-3)
+    parser.add_argument('-f', '--overwrite', action='store_true',
+                        help='convert files whose output is up to date')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    batch_results = unpack_batch(args.path,
+                                 out_path=args.out_path,
+                                 data_type=args.data_type,
+                                 duty_cycle=args.duty_cycle,
+                                 workers=args.workers,
+                                 shards=args.shards,
+                                 chunk_frames=args.chunk_frames,
+                                 file_format=args.format,
+                                 overwrite=args.overwrite)
+
+    status = [result['status'] for result in batch_results]
+    print('{} converted, {} skipped, {} failed in {:.1f} s'.format(
+        status.count('done'), status.count('skipped'),
+        status.count('failed'), time.perf_counter()-start))
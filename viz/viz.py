@@ -27,10 +27,129 @@
 
 """
 
+import os
+
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 import plotly.io as pio
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+try:
+    # only plotly >= 6 encodes typed arrays, older versions send lists
+    from _plotly_utils.utils import to_typed_array_spec
+except ImportError:
+    to_typed_array_spec = None
+
+
+# numerical arrays of scatter traces are sent as base64 typed arrays
+# instead of JSON lists
+BINARY_ARRAYS = to_typed_array_spec is not None and \
+    os.environ.get('SENSORVIEW_BINARY_ARRAYS', '1') != '0'
+
+# float columns are sent as float32 when its spacing at the largest value
+# is within this resolution
+FLOAT32_RESOLUTION = 1e-3
+
+
+def encode_array(values):
+    if not BINARY_ARRAYS or to_typed_array_spec is None or values is None:
+        return values
+
+    if isinstance(values, (pd.Series, pd.Index)):
+        if not pd.api.types.is_numeric_dtype(values.dtype) or \
+                pd.api.types.is_bool_dtype(values.dtype):
+            return values
+        values = values.to_numpy()
+
+    if values.dtype.kind == 'f' and values.dtype.itemsize > 4 and \
+            len(values) > 0:
+        max_abs = np.nanmax(np.abs(values)) if \
+            not np.all(np.isnan(values)) else 0
+        if np.isfinite(max_abs) and \
+                np.spacing(np.float32(max_abs)) <= FLOAT32_RESOLUTION:
+            values = values.astype(np.float32)
+    return to_typed_array_spec(values)
+
+
+def hover_format(format_str):
+    # python format specs such as '{:,.2f}' share their syntax with the
+    # d3 format specs of plotly hover templates
+    if format_str.startswith('{:') and format_str.endswith('}'):
+        return format_str[2:-1]
+    return None
+
+
+def get_hover_text(det_list, hover_dict, keys):
+    # text lines of the non-numerical keys, built once for every distinct
+    # combination of values instead of once per row
+    combos = np.zeros(len(det_list.index), dtype=np.int64)
+    codes = []
+    lines = []
+    for key in keys:
+        column = det_list[hover_dict[key]['key']]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            key_codes = column.cat.codes.to_numpy().astype(np.int64)
+            values = list(column.cat.categories.astype(str))+['nan']
+            key_codes[key_codes < 0] = len(values)-1
+        else:
+            key_codes, values = pd.factorize(column.astype(str))
+
+        codes.append(key_codes)
+        lines.append([hover_dict[key]['description']+': '+value+'<br>'
+                      for value in values])
+        combos = pd.factorize(combos*len(values)+key_codes)[0]
+
+    # one string per combination, taken from its first row
+    first = np.flatnonzero(~pd.Series(combos).duplicated().to_numpy())
+    text = np.empty(len(first), dtype=object)
+    for row in first:
+        text[combos[row]] = ''.join([
+            lines[idx][key_codes[row]]
+            for idx, key_codes in enumerate(codes)])
+    return text[combos]
+
+
+def get_hover_data(det_list, hover_dict):
+    # numerical hover values are sent as customdata columns and formatted
+    # by plotly through a template, only the text of the non-numerical
+    # keys is built here. Points have a single text field, so the lines of
+    # all non-numerical keys are one block at the position of the first
+    # of them, numerical keys listed between them come after the block
+    if hover_dict is None:
+        hover_dict = {}
+
+    columns = []
+    text_keys = []
+    template = ''
+    for key in hover_dict:
+        column = det_list[hover_dict[key]['key']]
+        if not pd.api.types.is_numeric_dtype(column.dtype):
+            if len(text_keys) == 0:
+                template = template+'%{text}'
+            text_keys.append(key)
+            continue
+
+        spec = None
+        if 'format' in hover_dict[key]:
+            spec = hover_format(hover_dict[key]['format'])
+        if spec is None:
+            field = '%{customdata['+str(len(columns))+']}'
+        else:
+            field = '%{customdata['+str(len(columns))+']:'+spec+'}'
+        template = template+hover_dict[key]['description']+': '+field+'<br>'
+        columns.append(column.to_numpy(dtype=float))
+
+    customdata = None
+    if len(columns) > 0:
+        customdata = np.column_stack(columns)
+
+    text = None
+    if len(text_keys) > 0:
+        text = get_hover_text(det_list, hover_dict, text_keys)
+
+    return customdata, text, template
 
 
 def get_figure_data(det_list,
@@ -50,18 +169,8 @@ def get_figure_data(det_list,
         if db:
             color = 20*np.log10(color)
 
-        rows = len(det_list.index)
-
-        hover = np.full(rows, '', dtype=object)
-
-        for idx, key in enumerate(hover_dict):
-            if 'format' in hover_dict[key]:
-                hover = hover + hover_dict[key]['description'] + ': ' + \
-                    det_list[hover_dict[key]['key']].map(
-                        hover_dict[key]['format'].format)+'<br>'
-            else:
-                hover = hover + hover_dict[key]['description'] + \
-                    ': ' + det_list[hover_dict[key]['key']]+'<br>'
+        customdata, text, hovertemplate = get_hover_data(
+            det_list, hover_dict)
 
         if '_IDS_' in det_list.columns:
             ids = det_list['_IDS_']
@@ -71,18 +180,19 @@ def get_figure_data(det_list,
         det_map = dict(
             type='scatter3d',
             ids=ids,
-            x=det_list[x_key],
-            y=det_list[y_key],
-            z=det_list[z_key],
-            text=hover,
-            hovertemplate='%{text}',
+            x=encode_array(det_list[x_key]),
+            y=encode_array(det_list[y_key]),
+            z=encode_array(det_list[z_key]),
+            customdata=encode_array(customdata),
+            text=text,
+            hovertemplate=hovertemplate,
             # +'Lateral: %{x:.2f} m<br>' +
             # 'Longitudinal: %{y:.2f} m<br>'+'Height: %{z:.2f} m<br>',
             mode='markers',
             name=name,
             marker=dict(
                 size=3,
-                color=color,
+                color=encode_array(color),
                 colorscale=colormap,
                 opacity=0.8,
                 colorbar=dict(
@@ -157,10 +267,30 @@ def get_figure_layout(
     )
 
 
+def histogram_bins(values, bins='fd', max_bins=500):
+    # Freedman-Diaconis bins by default, capped for columns with a narrow
+    # inter-quartile range
+    edges = np.histogram_bin_edges(values, bins=bins)
+    if isinstance(bins, str) and len(edges) == 2 and \
+            values.min() < values.max():
+        # a zero inter-quartile range gives one bin, as for discrete
+        # columns where most rows share one value
+        if np.all(values == np.round(values)) and \
+                values.max()-values.min() < max_bins:
+            edges = np.arange(values.min(), values.max()+2)-0.5
+        else:
+            edges = np.histogram_bin_edges(values, bins='sturges')
+    if len(edges)-1 > max_bins:
+        edges = np.histogram_bin_edges(values, bins=max_bins)
+    return edges
+
+
 def get_histogram(det_list,
                   x_key,
                   x_label=None,
                   histnorm='probability',
+                  bins='fd',
+                  max_bins=500,
                   margin=dict(l=40, r=40, b=40, t=60)
                   ):
     if x_label is None:
@@ -171,15 +301,44 @@ def get_histogram(det_list,
     else:
         y_label = 'Count'
 
+    # binned here so only one value per bin is sent to the browser
+    column = det_list[x_key]
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        values = column.to_numpy(dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) > 0:
+            edges = histogram_bins(values, bins, max_bins)
+            counts = np.histogram(values, bins=edges)[0]
+        else:
+            edges = np.zeros(1)
+            counts = np.zeros(0, dtype=np.int64)
+        x = (edges[:-1]+edges[1:])/2
+        width = np.diff(edges)
+    else:
+        value_counts = column.value_counts(sort=False)
+        x = value_counts.index.astype(str).to_numpy()
+        counts = value_counts.to_numpy()
+        width = None
+
+    total = np.sum(counts)
+    if histnorm == 'probability':
+        y = counts/total if total > 0 else counts
+    elif histnorm == 'density' and width is not None:
+        y = counts/np.where(width > 0, width, 1)
+    else:
+        y = counts
+
     return dict(
         data=[dict(
-            type='histogram',
-            x=det_list[x_key],
-            histnorm=histnorm,
+            type='bar',
+            x=x,
+            y=y,
+            width=width,
             opacity=0.75,
         )],
         layout=dict(
             barmode='overlay',
+            bargap=0,
             xaxis=dict(title=x_label),
             yaxis=dict(title=y_label),
             margin=margin,
@@ -190,11 +349,32 @@ def get_histogram(det_list,
     )
 
 
+def get_density(det_list, x_key, y_key, weight_key=None, bins=100):
+    # bins x bins grid of counts, or of summed weights, z[y][x] as plotly
+    # expects it
+    x = det_list[x_key].to_numpy(dtype=float)
+    y = det_list[y_key].to_numpy(dtype=float)
+    valid = np.isfinite(x) & np.isfinite(y)
+
+    weights = None
+    if weight_key is not None:
+        weights = np.nan_to_num(
+            det_list[weight_key].to_numpy(dtype=float)[valid])
+
+    z, x_edges, y_edges = np.histogram2d(
+        x[valid], y[valid], bins=bins, weights=weights)
+    return x_edges, y_edges, z.T
+
+
 def get_heatmap(det_list,
                 x_key,
                 y_key,
                 x_label=None,
                 y_label=None,
+                weight_key=None,
+                weight_label=None,
+                bins=100,
+                density=None,
                 margin=dict(l=40, r=40, b=40, t=60)
                 ):
     if x_label is None:
@@ -203,12 +383,27 @@ def get_heatmap(det_list,
     if y_label is None:
         y_label = y_key
 
+    if weight_key is None:
+        weight_label = 'Count'
+    elif weight_label is None:
+        weight_label = weight_key
+
+    # the grid is computed here, so the trace has the same size whatever
+    # the number of rows
+    if density is None:
+        density = get_density(det_list, x_key, y_key, weight_key, bins)
+    x_edges, y_edges, z = density
+
     return dict(
         data=[dict(
-            type='histogram2dcontour',
-            x=det_list[x_key],
-            y=det_list[y_key],
-            colorscale='Jet'
+            type='contour',
+            x=(x_edges[:-1]+x_edges[1:])/2,
+            y=(y_edges[:-1]+y_edges[1:])/2,
+            z=z,
+            colorscale='Jet',
+            colorbar=dict(
+                title=weight_label,
+            ),
         )],
         layout=dict(
             xaxis=dict(title=x_label),
@@ -245,12 +440,12 @@ def get_2d_scatter(det_list,
         data=[dict(
             type='scattergl',
             ids=det_list['_IDS_'],
-            x=det_list[x_key],
-            y=det_list[y_key],
+            x=encode_array(det_list[x_key]),
+            y=encode_array(det_list[y_key]),
             mode='markers',
             marker=dict(
                 size=5,
-                color=det_list[color_key],
+                color=encode_array(det_list[color_key]),
                 colorscale=colormap,
                 opacity=0.8,
                 colorbar=dict(
@@ -278,20 +473,29 @@ def frame_args(duration):
     }
 
 
-def get_animation_data(det_list,
-                       x_key,
-                       y_key,
-                       z_key,
-                       host_x_key,
-                       host_y_key,
-                       color_key=None,
-                       hover_dict=None,
-                       c_range=[-30, 30],
-                       db=False,
-                       colormap='Rainbow',
-                       title=None,
-                       height=650):
+def iter_frame_slices(det_list, frame_key='Frame'):
+    # one stable sort, every frame is then a contiguous slice
+    if not det_list[frame_key].is_monotonic_increasing:
+        det_list = det_list.sort_values(frame_key, kind='mergesort')
+    det_list = det_list.reset_index(drop=True)
+
+    values = det_list[frame_key].to_numpy()
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]]) \
+        if len(values) > 0 else np.zeros(0, dtype=np.int64)
+    stops = np.r_[starts[1:], len(values)].astype(np.int64)
+
+    for start, stop in zip(starts, stops):
+        yield values[start], det_list.iloc[start:stop].reset_index(drop=True)
 
+
+def get_animation_ranges(det_list,
+                         x_key,
+                         y_key,
+                         z_key,
+                         host_x_key,
+                         host_y_key,
+                         color_key=None,
+                         c_range=[-30, 30]):
     x_range = [np.min([np.min(det_list[x_key]),
                        np.min(det_list[host_x_key])]),
                np.max([np.max(det_list[x_key]),
@@ -307,38 +511,53 @@ def get_animation_data(det_list,
         c_range = [np.min(det_list[color_key]),
                    np.max(det_list[color_key])]
 
-    ani_frames = []
-    frame_list = det_list['Frame'].unique()
-
-    for frame_idx in frame_list:
-        filtered_list = det_list[det_list['Frame'] == frame_idx]
-        filtered_list = filtered_list.reset_index()
-
-        ani_frames.append(
-            dict(
-                data=[
-                    get_figure_data(
-                        filtered_list,
-                        x_key,
-                        y_key,
-                        z_key,
-                        color_key,
-                        color_label=color_key,
-                        name='Frame: '+str(frame_idx),
-                        hover_dict=hover_dict,
-                        c_range=c_range,
-                        db=db,
-                        colormap=colormap),
-                    get_host_data(
-                        filtered_list,
-                        host_x_key,
-                        host_y_key)
-                ],
-                # need to name the frame for the animation to behave properly
-                name=str(frame_idx)
-            )
+    return x_range, y_range, z_range, c_range
+
+
+def get_animation_frames(det_list,
+                         x_key,
+                         y_key,
+                         z_key,
+                         host_x_key,
+                         host_y_key,
+                         color_key=None,
+                         hover_dict=None,
+                         c_range=[-30, 30],
+                         db=False,
+                         colormap='Rainbow'):
+    # frames are generated one at a time, so they can be written out
+    # without holding the whole animation
+    for frame_idx, filtered_list in iter_frame_slices(det_list):
+        yield dict(
+            data=[
+                get_figure_data(
+                    filtered_list,
+                    x_key,
+                    y_key,
+                    z_key,
+                    color_key,
+                    color_label=color_key,
+                    name='Frame: '+str(frame_idx),
+                    hover_dict=hover_dict,
+                    c_range=c_range,
+                    db=db,
+                    colormap=colormap),
+                get_host_data(
+                    filtered_list,
+                    host_x_key,
+                    host_y_key)
+            ],
+            # need to name the frame for the animation to behave properly
+            name=str(frame_idx)
         )
 
+
+def get_animation_layout(x_range,
+                         y_range,
+                         z_range,
+                         frame_names,
+                         title=None,
+                         height=650):
     sliders = [
         {
             'pad': {'b': 10, 't': 40},
@@ -347,11 +566,11 @@ def get_animation_data(det_list,
             'y': 0,
             'steps': [
                 {
-                    'args': [[f['name']], frame_args(0)],
+                    'args': [[f], frame_args(0)],
                     'label': str(k),
                     'method': 'animate',
                 }
-                for k, f in enumerate(ani_frames)
+                for k, f in enumerate(frame_names)
             ],
         }
     ]
@@ -397,9 +616,97 @@ def get_animation_data(det_list,
         }
     ]
     figure_layout['sliders'] = sliders
+    return figure_layout
+
+
+def get_animation_data(det_list,
+                       x_key,
+                       y_key,
+                       z_key,
+                       host_x_key,
+                       host_y_key,
+                       color_key=None,
+                       hover_dict=None,
+                       c_range=[-30, 30],
+                       db=False,
+                       colormap='Rainbow',
+                       title=None,
+                       height=650):
+
+    x_range, y_range, z_range, c_range = get_animation_ranges(
+        det_list, x_key, y_key, z_key, host_x_key, host_y_key,
+        color_key, c_range)
+
+    ani_frames = list(get_animation_frames(
+        det_list, x_key, y_key, z_key, host_x_key, host_y_key,
+        color_key, hover_dict, c_range, db, colormap))
+
+    figure_layout = get_animation_layout(
+        x_range,
+        y_range,
+        z_range,
+        [f['name'] for f in ani_frames],
+        title=title,
+        height=height)
 
     return dict(data=[ani_frames[0]['data'][0], ani_frames[0]['data'][1]],
                 frames=ani_frames,
                 layout=figure_layout)
     # fig.show()
     # fig.write_html(file_name[:-4]+'.html')
+
+
+def write_animation(det_list,
+                    file_name,
+                    x_key,
+                    y_key,
+                    z_key,
+                    host_x_key,
+                    host_y_key,
+                    color_key=None,
+                    hover_dict=None,
+                    c_range=[-30, 30],
+                    db=False,
+                    colormap='Rainbow',
+                    title=None,
+                    height=650,
+                    include_plotlyjs='cdn'):
+    # HTML animation written frame by frame, only the frame being encoded
+    # is held in memory
+    x_range, y_range, z_range, c_range = get_animation_ranges(
+        det_list, x_key, y_key, z_key, host_x_key, host_y_key,
+        color_key, c_range)
+
+    frame_names = [str(frame_idx) for frame_idx in
+                   pd.unique(det_list['Frame'].sort_values())]
+    figure_layout = get_animation_layout(
+        x_range, y_range, z_range, frame_names, title=title, height=height)
+
+    if include_plotlyjs == 'cdn':
+        plotlyjs = '<script src="https://cdn.plot.ly/plotly-' + \
+            get_plotlyjs_version()+'.min.js"></script>'
+    else:
+        plotlyjs = '<script type="text/javascript">' + \
+            get_plotlyjs()+'</script>'
+
+    with open(file_name, 'w') as html_file:
+        html_file.write('<html>\n<head><meta charset="utf-8" /></head>\n'
+                        '<body>\n'+plotlyjs+'\n'
+                        '<div id="animation"></div>\n'
+                        '<script type="text/javascript">\n'
+                        'var frames = [];\n')
+
+        first = None
+        for frame in get_animation_frames(
+                det_list, x_key, y_key, z_key, host_x_key, host_y_key,
+                color_key, hover_dict, c_range, db, colormap):
+            if first is None:
+                first = frame['data']
+            html_file.write('frames.push('+to_json_plotly(frame)+');\n')
+
+        html_file.write(
+            'Plotly.newPlot("animation", '+to_json_plotly(first)+', ' +
+            to_json_plotly(figure_layout)+').then(function () {\n'
+            '    Plotly.addFrames("animation", frames);\n'
+            '});\n'
+            '</script>\n</body>\n</html>\n')